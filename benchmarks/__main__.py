@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from fnmatch import fnmatch
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any
+
+import sklearn
+import torch
+
+from benchmarks.models import BENCHMARKS, SAMPLERS, run_benchmark
+
+DEFAULT_ROWS = 2000
+DEFAULT_SEED = 0
+# The AutoML modes take hours, and ADASYN fails on the synthetic data (it rounds the number of samples to generate
+# near every sample of the smaller classes down to none), so they are opt-in
+DEFAULT_MODELS = ["simple", *[f"sampled.{sampler}" for sampler in SAMPLERS if sampler != "ADASYN"], "forest",
+                  "solution"]
+DEFAULT_OUTPUT_PATH = "benchmark.json"
+COMPARED_MEASUREMENTS = ["fit_seconds", "predict_seconds", "memory_mib"]
+
+
+def read_args() -> tuple[list[str], int, int, str, str | None, float | None, float | None]:
+    parser = argparse.ArgumentParser("python -m benchmarks",
+                                     description="Measure the training and prediction of the models on synthetic data",
+                                     epilog="Exits with status 1 if a model exceeds a budget, or 2 if a model fails")
+    parser.add_argument("-m", "--models", nargs="+", default=DEFAULT_MODELS, metavar="M",
+                        help=f"Models to benchmark, as names or patterns (default: {' '.join(DEFAULT_MODELS)}; "
+                             f"available: {', '.join(BENCHMARKS)})")
+    parser.add_argument("-n", "--rows", type=int, default=DEFAULT_ROWS, metavar="N",
+                        help="Number of rows of the synthetic datasets, of which 80%% are used for training")
+    parser.add_argument("-s", "--seed", type=int, default=DEFAULT_SEED, metavar="S",
+                        help="Seed of the synthetic datasets and the models")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT_PATH, metavar="O",
+                        help="Path of the JSON report")
+    parser.add_argument("--compare", default=None, metavar="REPORT",
+                        help="Report of an earlier run (e.g. of another commit) to compare the results with")
+    parser.add_argument("--max_fit_seconds", type=float, default=None, metavar="S",
+                        help="Time budget of fitting each model; exceeding it fails the run")
+    parser.add_argument("--max_memory_mib", type=float, default=None, metavar="MIB",
+                        help="Memory budget of each model (the growth of its process' peak RSS during fitting and "
+                             "prediction); exceeding it fails the run")
+    args = parser.parse_args()
+
+    models = [name for name in BENCHMARKS if any(fnmatch(name, pattern) for pattern in args.models)]
+    if not models:
+        parser.error(f"no models match {' '.join(args.models)}")
+    return models, args.rows, args.seed, args.output, args.compare, args.max_fit_seconds, args.max_memory_mib
+
+
+def environment() -> dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except:
+        commit = None
+    return {"commit": commit, "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count(),
+            "torch": torch.__version__, "sklearn": sklearn.__version__}
+
+
+def compare(results: dict[str, dict[str, Any]], path: str) -> None:
+    with open(path) as file:
+        previous = json.load(file)
+    print(f"Compared with {path} (commit {previous['environment']['commit']}):")
+    for name, result in results.items():
+        if "error" not in result and "error" not in (before := previous["results"].get(name, {"error": None})):
+            changes = ", ".join(f"{measurement}: {before[measurement]:.2f} -> {result[measurement]:.2f} "
+                                f"({result[measurement] / before[measurement] - 1:+.0%})"
+                                for measurement in COMPARED_MEASUREMENTS if measurement in before)
+            print(f"  {name}: {changes}")
+
+
+if __name__ == "__main__":
+    models, rows, seed, output, compare_path, max_fit_seconds, max_memory_mib = read_args()
+
+    results = {}
+    for name in models:
+        # Every model runs in a fresh process, so that it does not share its peak RSS or warm caches with the others
+        with ProcessPoolExecutor(1, get_context("spawn")) as executor:
+            try:
+                result = executor.submit(run_benchmark, name, rows, seed).result()
+            except Exception as e:
+                # A model that fails on the synthetic data (e.g. a sampler with nothing to generate) is reported
+                results[name] = {"error": repr(e)}
+                print(f"{name}: failed with {e!r}")
+                continue
+        result["within_budget"] = ((max_fit_seconds is None or result["fit_seconds"] <= max_fit_seconds) and
+                                   (max_memory_mib is None or result["memory_mib"] <= max_memory_mib))
+        results[name] = result
+        print(f"{name}: fit {result['fit_seconds']:.2f} s ({result['fit_throughput']:.1f} rows/s), "
+              f"predict {result['predict_seconds']:.2f} s ({result['predict_throughput']:.1f} rows/s), "
+              f"memory {result['memory_mib']:.0f} MiB (peak RSS {result['peak_rss_mib']:.0f} MiB, "
+              f"{result['baseline_rss_mib']:.0f} MiB before fitting)"
+              f"{'' if result['within_budget'] else ', OVER BUDGET'}")
+
+    report = {"environment": environment(), "rows": rows, "seed": seed, "results": results}
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Saved the report to {output}")
+
+    if compare_path is not None:
+        compare(results, compare_path)
+    if failed := [name for name, result in results.items() if "error" in result]:
+        print(f"Failed: {', '.join(failed)}")
+        raise SystemExit(2)
+    if not all(result["within_budget"] for result in results.values()):
+        raise SystemExit(1)
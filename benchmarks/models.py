@@ -0,0 +1,188 @@
+import resource
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable
+from unittest import TestCase, skipUnless
+
+import imblearn.combine
+import imblearn.over_sampling
+import numpy as np
+import torch
+from supervised.automl import AutoML
+
+from benchmarks.synthetic import make_simple_dataset, make_solution_dataset, tiny_encoder_config
+from simple.models import SEED, Sampled, Simple
+from solution.custom_random_forest import CustomRandomForest
+from solution.data import partition_data
+from solution.model import Model, predict, train
+
+TEST_SIZE = 0.2
+SOLUTION_BATCH_SIZE = 8
+RSS_INTERVAL = 0.01  # seconds
+
+SAMPLERS = ["RandomOverSampler", "SMOTE", "ADASYN", "SMOTETomek", "SMOTEENN"]
+AUTOML_MODES = ["Perform", "Compete", "Optuna"]
+
+
+def run_benchmark(name: str, rows: int, seed: int) -> dict[str, Any]:
+    """Runs the benchmark of the given name; it should run in a fresh process, so that its peak RSS is its own."""
+    torch.manual_seed(seed)
+    return BENCHMARKS[name](rows, np.random.default_rng(seed))
+
+
+def _measure(fit: Callable[[], Any], predict: Callable[[], Any], train_rows: int, test_rows: int) -> dict[str, Any]:
+    """
+    Times the fit and predict calls, and measures the memory of the model as the growth of the peak RSS over the RSS
+    before fitting, which excludes the imports (of e.g. torch and AutoML) and the generated dataset.
+    """
+    baseline_rss = _reset_peak_rss_mib()
+    with _RssWatcher() as watcher:
+        start = time.perf_counter()
+        fit()
+        fit_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        predict()
+        predict_seconds = time.perf_counter() - start
+    # The measured code may reset the peak RSS itself, in which case the sampled RSS is the better estimate
+    peak_rss = max(_peak_rss_mib(), watcher.peak_rss_mib)
+    return {"train_rows": train_rows, "test_rows": test_rows,
+            "fit_seconds": fit_seconds, "predict_seconds": predict_seconds,
+            "fit_throughput": train_rows / fit_seconds, "predict_throughput": test_rows / predict_seconds,
+            "baseline_rss_mib": baseline_rss, "peak_rss_mib": peak_rss, "memory_mib": peak_rss - baseline_rss}
+
+
+class _RssWatcher:
+    """Samples the RSS of the process in a thread, every `RSS_INTERVAL` seconds, and keeps its maximum."""
+
+    def __init__(self) -> None:
+        self.peak_rss_mib = 0.
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "_RssWatcher":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            self.peak_rss_mib = max(self.peak_rss_mib, _proc_status_mib("VmRSS") or 0.)
+            if self._stopped.wait(RSS_INTERVAL):
+                break
+
+
+def _reset_peak_rss_mib() -> float:
+    """Resets the peak RSS of the process to its current RSS, which is returned."""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")  # Linux only
+    except OSError:
+        pass  # the peak then includes anything before the measurement, which overstates the memory of the model
+    return _proc_status_mib("VmRSS") or _peak_rss_mib()
+
+
+def _peak_rss_mib() -> float:
+    return _proc_status_mib("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def _proc_status_mib(field: str) -> float | None:
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 1024  # kB
+    except OSError:
+        pass
+    return None
+
+
+def _split(rows: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    order = rng.permutation(rows)
+    test_rows = max(1, int(rows * TEST_SIZE))
+    return order[test_rows:], order[:test_rows]
+
+
+def _benchmark_simple(model_factory: Callable[[], Any]) -> Callable[[int, np.random.Generator], dict[str, Any]]:
+    def benchmark(rows: int, rng: np.random.Generator) -> dict[str, Any]:
+        X, y = make_simple_dataset(rows, rng)
+        train_idx, test_idx = _split(rows, rng)
+        X_train, y_train, X_test = X.iloc[train_idx], y.iloc[train_idx], X.iloc[test_idx]
+        model = model_factory()
+        return _measure(lambda: model.fit(X_train, y_train), lambda: model.predict(X_test),
+                        len(train_idx), len(test_idx))
+    return benchmark
+
+
+def _simple() -> Any:
+    model = Simple()
+    model._pipeline.memory = None  # the fitted stages must not come from the cache
+    return model
+
+
+def _sampled(sampler: str) -> Callable[[], Any]:
+    def factory() -> Any:
+        Sampler = getattr(imblearn.over_sampling, sampler, None) or getattr(imblearn.combine, sampler)
+        model = Sampled(sampler=Sampler(random_state=SEED))
+        model._pipeline.memory = None
+        return model
+    return factory
+
+
+def _automl(mode: str) -> Callable[[], Any]:
+    def factory() -> Any:
+        # The models are written to a temporary directory instead of a new AutoML_<n> directory in the working one
+        return AutoML(results_path=str(Path(tempfile.mkdtemp(prefix="benchmark")) / "automl"), mode=mode,
+                      max_single_prediction_time=None, random_state=SEED)
+    return factory
+
+
+def _benchmark_forest(rows: int, rng: np.random.Generator) -> dict[str, Any]:
+    X, Y = make_solution_dataset(rows, rng)
+    train_idx, test_idx = _split(rows, rng)
+    forest = CustomRandomForest(random_state=SEED)
+    return _measure(lambda: forest.fit(X["metrics"][train_idx], Y[train_idx].argmax(axis=1)),
+                    lambda: forest.predict_proba(X["metrics"][test_idx]), len(train_idx), len(test_idx))
+
+
+def _benchmark_solution(rows: int, rng: np.random.Generator) -> dict[str, Any]:
+    """One epoch of `solution.model.Model` with tiny random encoders, on synthetic token sequences."""
+    X, Y = make_solution_dataset(rows, rng)
+    train_idx, test_idx = _split(rows, rng)
+    X_train, Y_train = partition_data(X, train_idx), Y[train_idx]
+    X_test, Y_test = partition_data(X, test_idx), Y[test_idx]
+
+    device = torch.device("cpu")
+    model = Model(X["metrics"].shape[1], pack_sequences=True, encoder_config=tiny_encoder_config())
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5, eps=1e-7)
+    return _measure(lambda: train(model, device, optimizer, 1, SOLUTION_BATCH_SIZE, X_train, Y_train, X_test, Y_test,
+                                  True, rng, workers=0),
+                    lambda: predict(model, device, X_test, dynamic_padding=True, workers=0),
+                    len(train_idx), len(test_idx))
+
+
+BENCHMARKS: dict[str, Callable[[int, np.random.Generator], dict[str, Any]]] = {
+    "simple": _benchmark_simple(_simple),
+    **{f"sampled.{sampler}": _benchmark_simple(_sampled(sampler)) for sampler in SAMPLERS},
+    **{f"automl.{mode}": _benchmark_simple(_automl(mode)) for mode in AUTOML_MODES},
+    "forest": _benchmark_forest,
+    "solution": _benchmark_solution,
+}
+
+
+class TestMeasure(TestCase):
+    MIB = 200
+
+    @skipUnless(Path("/proc/self/clear_refs").exists(), "the peak RSS can only be reset on Linux")
+    def test_peak_of_code_resetting_it(self):
+        def fit():
+            memory = np.ones(self.MIB * 2**20 // 8)  # written, so that it is resident
+            time.sleep(20 * RSS_INTERVAL)
+            del memory
+            Path("/proc/self/clear_refs").write_text("5")
+
+        result = _measure(fit, lambda: None, 1, 1)
+        self.assertGreaterEqual(result["memory_mib"], self.MIB * 0.9)
+        self.assertGreaterEqual(result["peak_rss_mib"], result["baseline_rss_mib"] + self.MIB * 0.9)
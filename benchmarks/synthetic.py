@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from transformers import RobertaConfig
+
+from simple.models import CATEGORICAL_COLS, TEXTUAL_COL
+from solution.data import MAX_LENGTH, RaggedArray
+
+LABELS = ["DISCUSS", "DOCUMENTATION", "FALSE POSITIVE", "FUNCTION", "REFACTORING"]
+METRICS = 100
+VOCABULARY = 20000  # words of the comment texts
+TOKENS = 1000  # token ids of the tiny encoder
+PAD_TOKEN_ID = 1
+
+
+def make_labels(rows: int, rng: np.random.Generator) -> np.ndarray:
+    # The classes are imbalanced like in the dataset
+    return rng.choice(len(LABELS), rows, p=[0.35, 0.1, 0.05, 0.3, 0.2])
+
+
+def make_metrics(labels: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Random metrics, of which a few are shifted by the label, so that the models have something to learn."""
+    metrics = rng.normal(size=(len(labels), METRICS)).astype(np.float32)
+    metrics[:, :len(LABELS)] += 0.5 * np.eye(len(LABELS), dtype=np.float32)[labels]
+    return metrics
+
+
+def make_simple_dataset(rows: int, rng: np.random.Generator) -> tuple[pd.DataFrame, pd.Series]:
+    """A dataset in the format of `simple.training.load_dataset`, with Zipf-distributed comment words."""
+    labels = make_labels(rows, rng)
+    frequencies = 1 / np.arange(1, VOCABULARY + 1)
+    lengths = rng.integers(3, 60, rows)
+    ends = np.cumsum(lengths)
+    words = rng.choice(VOCABULARY, ends[-1], p=frequencies / frequencies.sum())
+    # Every label has a word of its own, which half of the comments of that label end with
+    words[ends - 1] = np.where(rng.random(rows) < 0.5, VOCABULARY + labels, words[ends - 1])
+    texts = [" ".join(f"w{word}" for word in comment) for comment in np.split(words, ends[:-1])]
+
+    X = pd.DataFrame({TEXTUAL_COL: texts,
+                      **{col: rng.choice(["PARENT", "REVISION"], rows) for col in CATEGORICAL_COLS}})
+    X = pd.concat([X, pd.DataFrame(make_metrics(labels, rng).astype(np.float64),
+                                   columns=[f"metric.{i}" for i in range(METRICS)])], axis=1)
+    return X, pd.Series(np.array(LABELS)[labels])
+
+
+def make_solution_dataset(rows: int, rng: np.random.Generator) -> tuple[dict, np.ndarray]:
+    """Inputs and one-hot labels in the format of `solution.data.get_data`, with random token ids."""
+    labels = make_labels(rows, rng)
+    X = {"comment": _random_tokens(rows, 8, 80, rng),
+         "code": _random_tokens(rows, 20, 300, rng),
+         "metrics": make_metrics(labels, rng)}
+    return X, np.eye(len(LABELS), dtype=np.float32)[labels]
+
+
+def tiny_encoder_config() -> RobertaConfig:
+    """A randomly initialised RoBERTa of a few layers, which stands in for CodeBERT without a download."""
+    return RobertaConfig(vocab_size=TOKENS, hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+                         intermediate_size=128, max_position_embeddings=MAX_LENGTH + 2, pad_token_id=PAD_TOKEN_ID)
+
+
+def _random_tokens(rows: int, min_length: int, max_length: int, rng: np.random.Generator) -> RaggedArray:
+    lengths = rng.integers(min_length, max_length, rows)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    return RaggedArray.from_offsets(rng.integers(PAD_TOKEN_ID + 2, TOKENS, offsets[-1]).astype(np.int32), offsets,
+                                    PAD_TOKEN_ID)
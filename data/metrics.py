@@ -0,0 +1,121 @@
+from unittest import TestCase
+
+import numpy as np
+from numpy.typing import ArrayLike
+from sklearn.metrics import accuracy_score, matthews_corrcoef, precision_recall_fscore_support
+
+METRIC_NAMES = ["accuracy", "mcc", "precision_macro", "precision_micro", "precision_weighted", "f1_macro", "f1_micro",
+                "f1_weighted", "recall_macro", "recall_micro", "recall_weighted"]
+BOOTSTRAP_SAMPLES = 2000
+CONFIDENCE = 0.95
+
+
+def confusion_matrix(true_class: ArrayLike, predicted_class: ArrayLike, classes: int) -> np.ndarray:
+    """Counts the samples of every true (row) and predicted (column) class among `classes` class indices."""
+    codes = np.asarray(true_class, dtype=np.int64) * classes + np.asarray(predicted_class, dtype=np.int64)
+    return np.bincount(codes, minlength=classes * classes).reshape(classes, classes)
+
+
+def scores(matrix: ArrayLike) -> dict[str, np.ndarray]:
+    """
+    Derives all metrics of `METRIC_NAMES` from confusion matrices, which may be stacked along leading axes.
+    The results match scikit-learn's, where an undefined precision, recall or F1 score of a class counts as 0,
+    and classes that neither occur nor are predicted are left out of the macro averages.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    true_positives = np.diagonal(matrix, axis1=-2, axis2=-1)
+    support = matrix.sum(axis=-1)
+    predicted = matrix.sum(axis=-2)
+    total = support.sum(axis=-1)
+    correct = true_positives.sum(axis=-1)
+
+    per_class = {"precision": _divide(true_positives, predicted),
+                 "recall": _divide(true_positives, support),
+                 "f1": _divide(2 * true_positives, support + predicted)}
+    present = (support + predicted) > 0
+    accuracy = _divide(correct, total)
+
+    results = {"accuracy": accuracy,
+               "mcc": _divide(correct * total - (support * predicted).sum(axis=-1),
+                              np.sqrt((total ** 2 - (predicted ** 2).sum(axis=-1)) *
+                                      (total ** 2 - (support ** 2).sum(axis=-1))))}
+    for name, values in per_class.items():
+        results[f"{name}_macro"] = _divide((values * present).sum(axis=-1), present.sum(axis=-1))
+        results[f"{name}_micro"] = accuracy  # every sample has a single true and predicted class
+        results[f"{name}_weighted"] = _divide((values * support).sum(axis=-1), total)
+    return {name: results[name] for name in METRIC_NAMES}
+
+
+def bootstrap_intervals(matrix: ArrayLike, rng: np.random.Generator, samples: int = BOOTSTRAP_SAMPLES,
+                        confidence: float = CONFIDENCE) -> dict[str, tuple[float, float]]:
+    """
+    Percentile bootstrap confidence intervals of all metrics. Resampling the samples with replacement only changes
+    the counts of the confusion matrix, so the resampled matrices are drawn from a multinomial distribution at once.
+    """
+    matrix = np.asarray(matrix)
+    total = matrix.sum()
+    resampled = rng.multinomial(total, matrix.ravel() / total, size=samples).reshape(samples, *matrix.shape)
+    tail = (1 - confidence) / 2 * 100
+    return {name: tuple(np.percentile(values, [tail, 100 - tail]))
+            for name, values in scores(resampled).items()}
+
+
+def _divide(numerator: ArrayLike, denominator: ArrayLike) -> np.ndarray:
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=np.float64), denominator)
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator != 0)
+
+
+class TestScores(TestCase):
+    CLASSES = 5
+
+    def assert_matches_sklearn(self, true_class, predicted_class):
+        results = scores(confusion_matrix(true_class, predicted_class, self.CLASSES))
+        self.assertAlmostEqual(results["accuracy"], accuracy_score(true_class, predicted_class))
+        self.assertAlmostEqual(results["mcc"], matthews_corrcoef(true_class, predicted_class))
+        for average in ["macro", "micro", "weighted"]:
+            precision, recall, f1, _ = precision_recall_fscore_support(true_class, predicted_class, average=average,
+                                                                       zero_division=0)
+            self.assertAlmostEqual(results[f"precision_{average}"], precision)
+            self.assertAlmostEqual(results[f"recall_{average}"], recall)
+            self.assertAlmostEqual(results[f"f1_{average}"], f1)
+
+    def test_matches_sklearn(self):
+        rng = np.random.default_rng(0)
+        true_class = rng.integers(0, self.CLASSES, 200)
+        predicted_class = np.where(rng.random(200) < 0.6, true_class, rng.integers(0, self.CLASSES, 200))
+        self.assert_matches_sklearn(true_class, predicted_class)
+
+    def test_class_missing_from_predictions(self):
+        self.assert_matches_sklearn([0, 1, 2, 2, 3, 3], [0, 1, 1, 1, 3, 0])
+
+    def test_class_missing_from_true_classes(self):
+        self.assert_matches_sklearn([0, 1, 1, 1, 3, 0], [0, 1, 2, 2, 3, 3])
+
+    def test_stacked_matrices(self):
+        matrices = np.stack([confusion_matrix([0, 1, 2, 2], [0, 1, 1, 2], self.CLASSES),
+                             confusion_matrix([3, 3, 4, 0], [3, 4, 4, 4], self.CLASSES)])
+        stacked = scores(matrices)
+        for i, matrix in enumerate(matrices):
+            for name, value in scores(matrix).items():
+                self.assertAlmostEqual(stacked[name][i], value)
+
+
+class TestBootstrapIntervals(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        true_class = rng.integers(0, 4, 300)
+        self.matrix = confusion_matrix(true_class, np.where(rng.random(300) < 0.7, true_class, rng.integers(0, 4, 300)),
+                                       4)
+
+    def test_deterministic(self):
+        self.assertEqual(bootstrap_intervals(self.matrix, np.random.default_rng(1)),
+                         bootstrap_intervals(self.matrix, np.random.default_rng(1)))
+
+    def test_contains_point_estimates(self):
+        intervals = bootstrap_intervals(self.matrix, np.random.default_rng(1))
+        self.assertEqual(list(intervals), METRIC_NAMES)
+        for name, value in scores(self.matrix).items():
+            low, high = intervals[name]
+            self.assertLessEqual(low, value, name)
+            self.assertLessEqual(value, high, name)
+            self.assertLess(low, high, name)
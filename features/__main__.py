@@ -1,3 +1,4 @@
+import argparse
 import signal
 
 from joblib import Parallel, delayed
@@ -8,28 +9,38 @@ from api.gerrit_api import GerritApi
 from api.api_cache import ApiCache
 from data.comment_meta import CommentMeta, load_comment_metas_from_dataset, load_comment_ids_from_dataset
 from features.feature_extractor import FeatureExtractor
+from features.feature_groups import FEATURE_GROUP_NAMES
+from features.feature_table import FeatureTable
+from features.file_batches import group_by_file
 from labels.data_labeler import DataLabeler
 
 LABELED_DATASET_PATH = "../turzo2023towards/dataset/labeled_dataset.xlsx"
 OUTPUT_DATASET_PATH = "dataset.xlsx"
-CHUNK_SIZE = 8
+CHUNK_SIZE = 8  # files processed in parallel
 
 
-def init_services() -> tuple[ApiCache, GerritApi, DataLabeler, FeatureExtractor]:
+def read_args() -> list[str]:
+    parser = argparse.ArgumentParser("python -m features", description="Generate the dataset from annotation data")
+    parser.add_argument("-g", "--groups", nargs="+", choices=FEATURE_GROUP_NAMES, default=FEATURE_GROUP_NAMES,
+                        metavar="G", help=f"Feature groups to extract (default: all of {', '.join(FEATURE_GROUP_NAMES)})")
+    return parser.parse_args().groups
+
+
+def init_services(groups: list[str] | None = None) -> tuple[ApiCache, GerritApi, DataLabeler, FeatureExtractor]:
     used_ids = load_comment_ids_from_dataset(LABELED_DATASET_PATH)
     cache = ApiCache()
     api = GerritApi("https://review.opendev.org", "openstack/nova", cache)
     labeler = DataLabeler(used_ids, api)
-    extractor = FeatureExtractor(api)
+    extractor = FeatureExtractor(api, groups)
     return cache, api, labeler, extractor
 
 
-def load_metas_and_entries(labeler: DataLabeler) -> tuple[list[CommentMeta], list[dict]]:
+def load_metas_and_entries(labeler: DataLabeler) -> tuple[list[CommentMeta], pd.DataFrame]:
     metas = [*load_comment_metas_from_dataset(LABELED_DATASET_PATH), *labeler.ready_comment_metas]
-    entries = []
+    entries = pd.DataFrame()
     try:
-        entries = pd.read_excel(OUTPUT_DATASET_PATH).to_dict(orient="records")
-        entry_ids = {e["meta.comment_id"] for e in entries}
+        entries = pd.read_excel(OUTPUT_DATASET_PATH)
+        entry_ids = set(entries["meta.comment_id"])
         metas = [m for m in metas if m.comment_id not in entry_ids]
         print(f"Skipping {len(entries)} records from the previous run... "
               f"Delete {OUTPUT_DATASET_PATH} to perform a clean generation.")
@@ -39,7 +50,8 @@ def load_metas_and_entries(labeler: DataLabeler) -> tuple[list[CommentMeta], lis
 
 
 def main():
-    cache, _, labeler, extractor = init_services()
+    groups = read_args()
+    cache, _, labeler, extractor = init_services(groups)
     metas, entries = load_metas_and_entries(labeler)
 
     stopped = False
@@ -51,21 +63,25 @@ def main():
             stopped = True
     signal.signal(signal.SIGINT, exit_handler)
 
+    # Comments on the same file are extracted together, so that the per-file work is shared. Every comment
+    # is written into its own row of the table, which keeps the original order.
+    file_groups = group_by_file(metas)
+    table = FeatureTable(extractor.schema, len(metas))
     with tqdm(initial=len(entries), total=len(entries)+len(metas)) as t:
         t.refresh()
-        for start in range(0, len(metas), CHUNK_SIZE):
-            chunk = metas[start:start+CHUNK_SIZE]
-            new_entries = Parallel(n_jobs=-1, backend="threading")(delayed(extractor.extract)(meta) for meta in chunk)
-            entries.extend(e for e in new_entries if e is not None)
+        for start in range(0, len(file_groups), CHUNK_SIZE):
+            chunk = file_groups[start:start+CHUNK_SIZE]
+            Parallel(n_jobs=-1, backend="threading")(
+                delayed(extractor.extract_file)([metas[i] for i in rows], table, rows) for rows in chunk)
             if stopped:
                 break
             t.set_postfix({"cached": cache.hit_ratio})
-            t.update(len(chunk))
+            t.update(sum(len(rows) for rows in chunk))
 
-    df = pd.json_normalize(entries)
+    df = pd.concat([entries, table.to_frame()], ignore_index=True)
     df = df.sort_values(by="meta.comment_id")
     df.to_excel(OUTPUT_DATASET_PATH, index=False)
-    print(f"Saved {len(entries)} records to {OUTPUT_DATASET_PATH}!")
+    print(f"Saved {len(df)} records to {OUTPUT_DATASET_PATH}!")
 
 
 if __name__ == "__main__":
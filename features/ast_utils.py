@@ -3,12 +3,27 @@ from ast import AST
 from unittest import TestCase
 from textwrap import dedent
 from typing import Any
+from dataclasses import dataclass
+from functools import lru_cache
 
 from features.text_utils import extract_range, line_count
 from features.ast_kind import AstKind, get_expr_kind, get_stmt_kind, is_function
+from features.interval_index import IntervalIndex
+from features.feature_table import Column
 
 _OPTIMAL_CONTEXT_LINES = 20
 _MAX_CONTEXT_STMT_LINES = 100
+_CONTEXT_INDEX_CACHE_SIZE = 32
+_KINDS = AstKind.stmts + AstKind.exprs
+
+CODE_METRIC_COLUMNS = [
+    Column("len", "int64"),
+    Column("lines", "int64"),
+    Column("cyc_comp", "int64"),
+    Column("nodes.all", "int64"),
+    *(Column(f"nodes.{kind.metric_label}", "int64") for kind in _KINDS),
+    *(Column(f"volumes.{kind.metric_label}", "float64") for kind in _KINDS),
+]
 
 
 def has_syntax_error(code: str) -> bool:
@@ -20,47 +35,119 @@ def has_syntax_error(code: str) -> bool:
 
 
 def extract_context(code: str, start_line: int | None, end_line: int | None) -> tuple[str, ast.stmt | ast.expr | ast.Module, int, int]:
-    # Return empty module for empty (blank line) contexts
-    if start_line is None or end_line is None or extract_range(code, start_line, end_line).strip() == "":
-        return "", ast.parse(""), -1, -1
-
-    # Build the statement path from the context node to the root
-    tree = ast.parse(code)
-    _adjust_decorator_lines(tree)
-    path = _build_path(tree, start_line, end_line, [])
-
-    # If the path is empty (probably a top-level comment), return the entire AST
-    if len(path) == 0:
-        return code, tree, 1, line_count(code)
-
-    # Prefer functions over other nodes
-    if func := next((n for n in path if is_function(n)), None):
-        return _return_context(code, func)
-
-    # Select the node which has the most suitable length
-    node = min(path, key=_context_score)
-
-    # Use statement if it is not extremely long
-    if _end_lineno(node) - node.lineno + 1 <= _MAX_CONTEXT_STMT_LINES:
-        return _return_context(code, node)
-
-    # Find the most suitable statement subexpression
-    path = [n for n in ast.walk(node)
-            if isinstance(n, ast.expr)
-            and n.lineno <= start_line and end_line <= _end_lineno(n)]
-    node = min(path, key=_context_score, default=node)
-    segment = ast.get_source_segment(code, node)
-    assert segment is not None
-    return dedent(segment), node, node.lineno, _end_lineno(node)
+    return get_context_index(code).extract_context(start_line, end_line)
+
+
+@lru_cache(maxsize=_CONTEXT_INDEX_CACHE_SIZE)
+def get_context_index(code: str) -> "ContextIndex":
+    return ContextIndex(code)
+
+
+@dataclass(frozen=True)
+class _StmtEntry:
+    node: ast.stmt
+    depth: int
+    pre: int
+    post: int
+    parent_pre: int
+
+
+@dataclass(frozen=True)
+class _ExprEntry:
+    node: ast.expr
+    pre: int
+    order: int
+
+
+class ContextIndex:
+    """
+    Answers comment code context queries for a single file.
+    The file is parsed and indexed once, so each context lookup only costs O(log n + k) for the k nodes around the range.
+    """
+
+    def __init__(self, code: str) -> None:
+        self._code = code
+        self._tree = ast.parse(code)
+        _adjust_decorator_lines(self._tree)
+
+        stmts: list[tuple[int, int, _StmtEntry]] = []
+        exprs: list[tuple[int, int, _ExprEntry]] = []
+        order = {id(node): i for i, node in enumerate(ast.walk(self._tree))}
+
+        # Pre-order traversal, where "pre" and "post" delimit the subtree of a node. Only the statements reachable
+        # through statement-only paths from the module are context candidates (e.g. except handler bodies are not).
+        pre = 0
+        stack: list[tuple[AST, int | None, int | None, int]] = [(self._tree, None, None, 0)]
+        while stack:
+            node, node_pre, parent_pre, depth = stack.pop()
+            if node_pre is not None:  # leaving the subtree of a statement candidate
+                assert isinstance(node, ast.stmt) and parent_pre is not None
+                stmts.append((node.lineno, _end_lineno(node), _StmtEntry(node, depth, node_pre, pre, parent_pre)))
+                continue
+
+            if isinstance(node, ast.expr):
+                exprs.append((node.lineno, _end_lineno(node), _ExprEntry(node, pre, order[id(node)])))
+
+            reachable = isinstance(node, ast.Module) or parent_pre is not None
+            if isinstance(node, ast.stmt) and parent_pre is not None:
+                stack.append((node, pre, parent_pre, depth))
+            for child in reversed(list(ast.iter_child_nodes(node))):
+                is_candidate = reachable and isinstance(child, ast.stmt)
+                stack.append((child, None, pre if is_candidate else None, depth + 1))
+            pre += 1
+
+        self._stmts = IntervalIndex(stmts)
+        self._exprs = IntervalIndex(exprs)
+
+    def extract_context(self, start_line: int | None, end_line: int | None) -> tuple[str, ast.stmt | ast.expr | ast.Module, int, int]:
+        code = self._code
+
+        # Return empty module for empty (blank line) contexts
+        if start_line is None or end_line is None or extract_range(code, start_line, end_line).strip() == "":
+            return "", ast.parse(""), -1, -1
+
+        # Build the statement path from the context node to the root
+        path = self._path(start_line, end_line)
+
+        # If the path is empty (probably a top-level comment), return the entire AST
+        if len(path) == 0:
+            return code, self._tree, 1, line_count(code)
+
+        # Prefer functions over other nodes
+        if func := next((e.node for e in path if is_function(e.node)), None):
+            return _return_context(code, func)
+
+        # Select the entry which has the most suitable length
+        entry = min(path, key=lambda e: _context_score(e.node))
+        node = entry.node
+
+        # Use statement if it is not extremely long
+        if _end_lineno(node) - node.lineno + 1 <= _MAX_CONTEXT_STMT_LINES:
+            return _return_context(code, node)
+
+        # Find the most suitable statement subexpression (the first one in breadth-first order in case of a tie)
+        candidates = [e for e in self._exprs.containing(start_line, end_line) if entry.pre < e.pre < entry.post]
+        node = min(candidates, key=lambda e: (_context_score(e.node), e.order), default=entry).node
+        segment = ast.get_source_segment(code, node)
+        assert segment is not None
+        return dedent(segment), node, node.lineno, _end_lineno(node)
+
+    def _path(self, start_line: int, end_line: int) -> list[_StmtEntry]:
+        # Descend from the root, always choosing the first child statement which contains the entire range
+        path: list[_StmtEntry] = []
+        parent_pre = 0
+        for entry in sorted(self._stmts.containing(start_line, end_line), key=lambda e: (e.depth, e.pre)):
+            if entry.parent_pre == parent_pre:
+                path.insert(0, entry)
+                parent_pre = entry.pre
+        return path
 
 
 def calculate_code_metrics(code: str, tree: AST | None = None) -> dict[str, Any]:
-    KINDS = AstKind.stmts + AstKind.exprs
-
     if tree is None:
         tree = ast.parse(code)
 
-    nodes = {kind.metric_label: 0 for kind in KINDS}
+    nodes = {kind.metric_label: 0 for kind in _KINDS}
     for node in ast.walk(tree):
         if kind := get_stmt_kind(node):
             nodes[kind.metric_label] += 1
@@ -68,35 +155,23 @@ def calculate_code_metrics(code: str, tree: AST | None = None) -> dict[str, Any]
             nodes[kind.metric_label] += 1
 
     all_nodes = _count_nodes(tree)
-    volumes = {}
-    if all_nodes > 0:
-        volumes = {kind.metric_label: nodes[kind.metric_label] / all_nodes for kind in KINDS}
-    else:
-        volumes = {kind.metric_label: 0 for kind in KINDS}
-
-    return {
+    metrics = {
         "len": len(code),
         "lines": line_count(code),
         "cyc_comp": _cyc_comp(tree),
-        "nodes": {
-            "all": all_nodes,
-            **nodes
-        },
-        "volumes": volumes
+        "nodes.all": all_nodes,
     }
+    for label, count in nodes.items():
+        metrics[f"nodes.{label}"] = count
+    for label, count in nodes.items():
+        metrics[f"volumes.{label}"] = count / all_nodes if all_nodes > 0 else 0.
+    return metrics
 
 
 def _context_score(node: ast.stmt | ast.expr) -> int:
     return abs((_end_lineno(node) - node.lineno + 1) - _OPTIMAL_CONTEXT_LINES)
 
 
-def _build_path(parent: AST, start_line: int, end_line: int, path: list[ast.stmt]) -> list[ast.stmt]:
-    for child in ast.iter_child_nodes(parent):
-        if isinstance(child, ast.stmt) and child.lineno <= start_line and end_line <= _end_lineno(child):
-            return _build_path(child, start_line, end_line, [child] + path)
-    return path
-
-
 def _return_context(code: str, node: ast.stmt) -> tuple[str, ast.stmt, int, int]:
     return dedent(extract_range(code, node.lineno, _end_lineno(node))), node, node.lineno, _end_lineno(node)
 
@@ -162,3 +237,35 @@ class TestAstUtils(TestCase):
         self.assertEqual(f.lineno, 1)
         self.assertEqual(C.lineno, 5)
         self.assertEqual(g.lineno, 8)
+
+    def test_extract_context(self):
+        code = "import os\n\n@dec\ndef f(x):\n    if x:\n        return 1\n    return 2\n\nclass C:\n    y = 3\n"
+        index = ContextIndex(code)
+
+        text, node, start, end = index.extract_context(6, 6)
+        self.assertEqual((text, start, end), ("@dec\ndef f(x):\n    if x:\n        return 1\n    return 2", 3, 7))
+        self.assertIsInstance(node, ast.FunctionDef)
+
+        text, node, start, end = index.extract_context(10, 10)
+        self.assertEqual((text, start, end), ("class C:\n    y = 3", 9, 10))
+        self.assertEqual(index.extract_context(1, 10), (code, index._tree, 1, 10))
+        self.assertEqual(index.extract_context(2, 2)[0::2], ("", -1))
+        self.assertEqual(index.extract_context(None, None)[0::2], ("", -1))
+
+    def test_extract_context_long_statement(self):
+        items = "\n".join(f"    {i}," for i in range(150))
+        code = f"x = [\n{items}\n]\ny = {{\n    'a': f(\n        1,\n    ),\n}}\n"
+        index = ContextIndex(code)
+
+        text, node, start, end = index.extract_context(10, 10)
+        self.assertIsInstance(node, ast.Constant)
+        self.assertEqual((text, start, end), ("8", 10, 10))
+        text, node, start, end = index.extract_context(155, 155)
+        self.assertEqual((text, start, end), ("y = {\n    'a': f(\n        1,\n    ),\n}", 153, 157))
+
+    def test_calculate_code_metrics(self):
+        metrics = calculate_code_metrics("def f(x):\n    return x + 1\n")
+        self.assertEqual(list(metrics.keys()), [c.name for c in CODE_METRIC_COLUMNS])
+        self.assertEqual((metrics["lines"], metrics["cyc_comp"], metrics["nodes.functions"]), (2, 1, 1))
+        self.assertEqual((metrics["volumes.ariths"], metrics["volumes.loops"]), (0.2, 0))
+        self.assertEqual(calculate_code_metrics("")["volumes.calls"], 0)
@@ -0,0 +1,141 @@
+import ast
+from typing import Any, Callable, TypeVar
+
+from api.blame_info import BlameInfo
+from api.change_info import ChangeInfo
+from api.comment_info import CommentInfo
+from api.gerrit_api import GerritApi
+from data.candidate_meta import CandidateMeta
+from data.comment_meta import CommentMeta
+from data.line_range import LineRange
+from features.ast_utils import ContextIndex, has_syntax_error, calculate_code_metrics
+from features.process_utils import calculate_blame_metrics
+
+T = TypeVar("T")
+
+
+class InvalidSourceError(Exception):
+    """Raised when a source required by a feature group can't be used (e.g. the code has a syntax error)."""
+
+
+class _Memo:
+    # functools.cached_property is not used on purpose, before Python 3.12 it holds a lock shared by all instances
+    # while computing the value, which would serialize the API requests of all extraction threads
+    def __init__(self) -> None:
+        self._values: dict[Any, Any] = {}
+
+    def _memo(self, key: Any, compute: Callable[[], T]) -> T:
+        if key not in self._values:
+            self._values[key] = compute()
+        return self._values[key]
+
+
+class FileSources(_Memo):
+    """
+    The Gerrit data and intermediate results shared by all comments on the same file of the same revision.
+    Everything is fetched or computed on first access, so only the sources required by the requested feature groups
+    are ever requested from the API. An instance is not thread-safe, it is meant to be used by a single worker.
+    """
+
+    def __init__(self, api: GerritApi, meta: CandidateMeta) -> None:
+        super().__init__()
+        self._api = api
+        self.meta = meta
+
+    @staticmethod
+    def key(meta: CandidateMeta) -> tuple[str, str, str]:
+        return meta.change_number, meta.revision_id, meta.file_path
+
+    @property
+    def change_info(self) -> ChangeInfo:
+        return self._memo("change_info", lambda: self._api.get_change_info(self.meta))
+
+    @property
+    def file_changes(self) -> list[ChangeInfo]:
+        return self._memo("file_changes", lambda: self._api.get_all_file_changes(
+            file_path=self.meta.file_path,
+            cutoff_time=self.change_info["created"],
+        ))
+
+    @property
+    def owner_name(self) -> str:
+        return self.change_info["owner"]["name"]
+
+    def code(self, old: bool) -> str:
+        code, valid = self._memo(("code", old), lambda: self._fetch_code(old))
+        if not valid:
+            raise InvalidSourceError("the code contains a syntax error")
+        return code
+
+    def blame(self, old: bool) -> list[BlameInfo]:
+        return self._memo(("blame", old), lambda: self._api.get_blame(self.meta, old=old))
+
+    def code_metrics(self, old: bool) -> dict[str, Any]:
+        return self._memo(("code_metrics", old), lambda: calculate_code_metrics(self.code(old)))
+
+    def blame_metrics(self, old: bool, reviewer_name: str) -> dict[str, Any]:
+        return self._memo(("blame_metrics", old, reviewer_name), lambda: calculate_blame_metrics(
+            self.blame(old), self.owner_name, reviewer_name))
+
+    def context_index(self, old: bool) -> ContextIndex:
+        return self._memo(("context_index", old), lambda: ContextIndex(self.code(old)))
+
+    def _fetch_code(self, old: bool) -> tuple[str, bool]:
+        code = self._api.get_code_old(self.meta) if old else self._api.get_code_new(self.meta)
+        return code, not has_syntax_error(code)
+
+
+class CommentSources(_Memo):
+    """The data and intermediate results needed to extract the features of a single comment."""
+
+    def __init__(self, file: FileSources, meta: CommentMeta, comment_info: CommentInfo, line_range: LineRange) -> None:
+        super().__init__()
+        assert FileSources.key(file.meta) == FileSources.key(meta)
+        self.file = file
+        self.meta = meta
+        self.comment_info = comment_info
+        self.line_range = line_range
+
+    @property
+    def change_info(self) -> ChangeInfo:
+        return self.file.change_info
+
+    @property
+    def file_changes(self) -> list[ChangeInfo]:
+        return self.file.file_changes
+
+    @property
+    def is_old_side(self) -> bool:
+        return self.comment_info.get("side", "REVISION") == "PARENT"
+
+    @property
+    def owner_name(self) -> str:
+        return self.file.owner_name
+
+    @property
+    def reviewer_name(self) -> str:
+        return self.comment_info["author"]["name"]
+
+    def code(self, old: bool) -> str:
+        return self.file.code(old)
+
+    def blame(self, old: bool) -> list[BlameInfo]:
+        return self.file.blame(old)
+
+    def code_metrics(self, old: bool) -> dict[str, Any]:
+        return self.file.code_metrics(old)
+
+    def blame_metrics(self, old: bool) -> dict[str, Any]:
+        return self.file.blame_metrics(old, self.reviewer_name)
+
+    @property
+    def code_comment_side(self) -> str:
+        return self.code(self.is_old_side)
+
+    @property
+    def blame_comment_side(self) -> list[BlameInfo]:
+        return self.blame(self.is_old_side)
+
+    @property
+    def context(self) -> tuple[str, ast.stmt | ast.expr | ast.Module, int, int]:
+        return self._memo("context", lambda: self.file.context_index(self.is_old_side).extract_context(**self.line_range))
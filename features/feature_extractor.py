@@ -1,98 +1,56 @@
-from typing import Any
+from dataclasses import replace
+from typing import Any, Iterable
 from unittest import TestCase
 
 from api.gerrit_api import GerritApi
 from api.comment_info import CommentInfo
 from data.comment_meta import CommentMeta
 from data.line_range import LineRange
-from features.ast_utils import has_syntax_error, extract_context, calculate_code_metrics
-from features.text_utils import extract_range, line_count, volume
-from features.process_utils import calculate_blame_metrics, calculate_change_metrics
+from features.comment_sources import CommentSources, FileSources, InvalidSourceError
+from features.feature_groups import extract_comment_features, feature_schema, get_feature_groups
+from features.feature_table import FeatureRow, FeatureTable
 
 
 class FeatureExtractor:
-    def __init__(self, api: GerritApi):
+    def __init__(self, api: GerritApi, groups: Iterable[str] | None = None):
         self._api = api
-
-    def extract(self, meta: CommentMeta) -> dict | None:
-        change_info = self._api.get_change_info(meta)
+        self._groups = get_feature_groups(groups)
+        self._group_names = frozenset(group.name for group in self._groups)
+        self.schema = feature_schema(self._groups)
+
+    def extract(self, meta: CommentMeta) -> dict[str, Any] | None:
+        table = FeatureTable(self.schema, 1)
+        self.extract_file([meta], table, [0])
+        return table.row_dict(0) if table.is_valid(0) else None
+
+    def extract_file(self, metas: list[CommentMeta], table: FeatureTable, rows: list[int]) -> None:
+        """
+        Writes the features of comments left on the same file of the same revision into the given table rows,
+        sharing the per-file work. The rows of comments which couldn't be extracted are left invalid.
+        """
+        file = FileSources(self._api, metas[0])
+        for meta, row in zip(metas, rows):
+            table.set_valid(row, self._extract(meta, file, table.row(row)))
+
+    def _extract(self, meta: CommentMeta, file: FileSources, row: FeatureRow) -> bool:
         comment_info = self._api.get_comment_info(meta)
-        if change_info is None or comment_info is None:
-            return None
-
-        owner_name = change_info["owner"]["name"]
-        reviewer_name = comment_info["author"]["name"]
+        if comment_info is None or self.extract_comment_features(comment_info) is None:
+            return False
 
-        comment = self.extract_comment_features(comment_info)
         line_range = self.extract_line_range(comment_info)
+        src = CommentSources(file, meta, comment_info, line_range)
 
-        code_old = self._api.get_code_old(meta)
-        code_new = self._api.get_code_new(meta)
-
-        blame_old = self._api.get_blame(meta, old=True)
-        blame_new = self._api.get_blame(meta, old=False)
-
-        if comment is None or has_syntax_error(code_old) or has_syntax_error(code_new):
-            return None
-
-        code_comment_side = code_old if comment["side"] == "PARENT" else code_new
-        blame_comment_side = blame_old if comment["side"] == "PARENT" else blame_new
-
-        code_range = extract_range(code_comment_side, **line_range)
-        code_context, ctx_tree, ctx_start, ctx_end = extract_context(code_comment_side, **line_range)
-
-        old_metrics = {
-            **calculate_code_metrics(code_old),
-            **calculate_blame_metrics(blame_old, owner_name, reviewer_name)
-        }
-        new_metrics = {
-            **calculate_code_metrics(code_new),
-            **calculate_blame_metrics(blame_new, owner_name, reviewer_name)
-        }
-
-        changes = calculate_change_metrics(
-            self._api.get_all_file_changes(
-                file_path=meta.file_path,
-                cutoff_time=change_info["created"],
-            ),
-            change_info["owner"]["_account_id"],
-            comment_info["author"]["_account_id"]
-        )
-
-        return {
-            "meta": {**meta.feature_dict, **line_range},
-            "comment": comment,
-            "code": {
-                "old": old_metrics,
-                "new": new_metrics,
-                "range": {
-                    "text": code_range,
-                    "volume": volume(code_range, code_comment_side),
-                    "len": len(code_range),
-                    "lines": line_count(code_range),
-                    **calculate_blame_metrics(blame_comment_side, owner_name, reviewer_name, **line_range)
-                },
-                "context": {
-                    "text": code_context,
-                    "volume": volume(code_context, code_comment_side),
-                    **calculate_code_metrics(code_context, ctx_tree),
-                    **calculate_blame_metrics(blame_comment_side, owner_name, reviewer_name, ctx_start, ctx_end)
-                },
-                "diff": self._diff_features(old_metrics, new_metrics),
-            },
-            "changes": changes
-        }
+        row.section("meta").update({**meta.feature_dict, **line_range})
+        try:
+            for group in self._groups:
+                group.compute(src, self._group_names, row)
+        except InvalidSourceError:
+            return False
+        return True
 
     @staticmethod
     def extract_comment_features(comment_info: CommentInfo) -> dict[str, Any] | None:
-        text = comment_info.get("message", "").strip()
-        if len(text) == 0:
-            return None
-        return {
-            "text": text,
-            "side": comment_info.get("side", "REVISION"),
-            "len": len(text),
-        }
+        return extract_comment_features(comment_info)
 
     @staticmethod
     def extract_line_range(comment_info: CommentInfo) -> LineRange:
@@ -108,22 +66,6 @@ class FeatureExtractor:
 
         return {"start_line": None, "end_line": None}
 
-    @staticmethod
-    def _diff_features(old_features: dict, new_features: dict) -> dict:
-        result = {}
-        common_keys = old_features.keys() & new_features.keys()
-
-        for key in common_keys:
-            old = old_features[key]
-            new = new_features[key]
-
-            if isinstance(old, int) or isinstance(old, float):
-                result[key] = new - old
-            elif isinstance(old, dict):
-                result[key] = FeatureExtractor._diff_features(old, new)
-
-        return result
-
 
 class TestFeatureExtractor(TestCase):
     def test_extract_comment_features(self):
@@ -158,9 +100,49 @@ class TestFeatureExtractor(TestCase):
             {"start_line": 3, "end_line": 3}
         )
 
-    def test_diff_features(self):
-        self.assertEqual(FeatureExtractor._diff_features(
-            {"a": 3, "b": {"c": 4, "d": 5}},
-            {"a": 5, "b": {"c": 0}}),
-            {"a": 2, "b": {"c": -4}}
-        )
+    class FakeApi:
+        def __init__(self):
+            self.calls = []
+
+        def __getattr__(self, name):
+            responses = {
+                "get_comment_info": {"message": "Rename x", "line": 2, "author": {"_account_id": 2, "name": "R"}},
+                "get_change_info": {"created": "2024-01-01", "owner": {"_account_id": 1, "name": "O"}},
+                "get_code_old": "x = 1\n",
+                "get_code_new": "x = 1\ny = x + 1\n",
+                "get_blame": [{"author": "O", "ranges": [{"start": 1, "end": 2}]}],
+                "get_all_file_changes": [{"owner": {"_account_id": 1}}],
+            }
+            self.calls.append(name)
+            return lambda *args, **kwargs: responses[name]
+
+    META = CommentMeta(comment_id="c", revision_id="r", change_number="1", file_path="f.py", url="u", label="DISCUSS")
+
+    def test_extract_selected_groups(self):
+        api = self.FakeApi()
+        features = FeatureExtractor(api, ["comment", "code.range"]).extract(self.META)
+        self.assertEqual(api.calls, ["get_comment_info", "get_code_new"])
+        self.assertEqual(features["code.range.text"], "y = x + 1")
+        self.assertNotIn("code.range.by_owner.lines", features)
+
+        api = self.FakeApi()
+        features = FeatureExtractor(api).extract(self.META)
+        self.assertEqual(set(api.calls), {"get_comment_info", "get_change_info", "get_code_old", "get_code_new",
+                                          "get_blame", "get_all_file_changes"})
+        self.assertEqual(list(features.keys()), [c.name for c in feature_schema(get_feature_groups())])
+        self.assertEqual(features["meta.start_line"], 2)
+        self.assertEqual(features["comment.side"], "REVISION")
+        self.assertEqual(features["code.range.by_owner.lines"], 1)
+        self.assertEqual(features["code.diff.lines"], 1)
+        self.assertEqual(features["changes.by_owner.count"], 1)
+
+    def test_extract_file(self):
+        api = self.FakeApi()
+        other = replace(self.META, comment_id="d")
+        extractor = FeatureExtractor(api)
+        table = FeatureTable(extractor.schema, 3)
+        extractor.extract_file([self.META, other], table, [2, 0])
+        self.assertEqual(table.to_frame()["meta.comment_id"].tolist(), ["d", "c"])
+        self.assertEqual(api.calls.count("get_comment_info"), 2)
+        self.assertEqual(api.calls.count("get_code_new"), 1)
+        self.assertEqual(api.calls.count("get_blame"), 2)
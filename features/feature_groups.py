@@ -0,0 +1,193 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Callable, ClassVar, Iterable
+from unittest import TestCase
+
+from api.comment_info import CommentInfo
+from features.comment_sources import CommentSources
+from features.ast_utils import CODE_METRIC_COLUMNS, calculate_code_metrics
+from features.feature_table import Column, FeatureRow
+from features.text_utils import extract_range, line_count, volume
+from features.process_utils import BLAME_METRIC_COLUMNS, CHANGE_METRIC_COLUMNS, calculate_blame_metrics, \
+    calculate_change_metrics
+
+
+def extract_comment_features(comment_info: CommentInfo) -> dict[str, Any] | None:
+    text = comment_info.get("message", "").strip()
+    if len(text) == 0:
+        return None
+    return {
+        "text": text,
+        "side": comment_info.get("side", "REVISION"),
+        "len": len(text),
+    }
+
+
+def _comment(src: CommentSources, _: frozenset[str], row: FeatureRow) -> None:
+    features = extract_comment_features(src.comment_info)
+    assert features is not None
+    row.section("comment").update(features)
+
+
+def _code_old(src: CommentSources, _: frozenset[str], row: FeatureRow) -> None:
+    row.section("code.old").update(src.code_metrics(old=True))
+
+
+def _code_new(src: CommentSources, _: frozenset[str], row: FeatureRow) -> None:
+    row.section("code.new").update(src.code_metrics(old=False))
+
+
+def _code_range(src: CommentSources, _: frozenset[str], row: FeatureRow) -> None:
+    code_range = extract_range(src.code_comment_side, **src.line_range)
+    section = row.section("code.range")
+    section["text"] = code_range
+    section["volume"] = volume(code_range, src.code_comment_side)
+    section["len"] = len(code_range)
+    section["lines"] = line_count(code_range)
+
+
+def _code_context(src: CommentSources, _: frozenset[str], row: FeatureRow) -> None:
+    code_context, ctx_tree, _, _ = src.context
+    section = row.section("code.context")
+    section["text"] = code_context
+    section["volume"] = volume(code_context, src.code_comment_side)
+    section.update(calculate_code_metrics(code_context, ctx_tree))
+
+
+def _code_diff(src: CommentSources, _: frozenset[str], row: FeatureRow) -> None:
+    row.section("code.diff").update(diff_features(src.code_metrics(old=True), src.code_metrics(old=False)))
+
+
+def _blame(src: CommentSources, groups: frozenset[str], row: FeatureRow) -> None:
+    # Blame metrics extend the code groups, so only the blames of the requested code groups are fetched
+    if "code.old" in groups:
+        row.section("code.old").update(src.blame_metrics(old=True))
+    if "code.new" in groups:
+        row.section("code.new").update(src.blame_metrics(old=False))
+    if "code.range" in groups:
+        row.section("code.range").update(calculate_blame_metrics(
+            src.blame_comment_side, src.owner_name, src.reviewer_name, **src.line_range))
+    if "code.context" in groups:
+        _, _, ctx_start, ctx_end = src.context
+        row.section("code.context").update(calculate_blame_metrics(
+            src.blame_comment_side, src.owner_name, src.reviewer_name, ctx_start, ctx_end))
+    if "code.diff" in groups:
+        row.section("code.diff").update(diff_features(src.blame_metrics(old=True), src.blame_metrics(old=False)))
+
+
+
+
+def _changes(src: CommentSources, _: frozenset[str], row: FeatureRow) -> None:
+    row.section("changes").update(calculate_change_metrics(
+        src.file_changes,
+        src.change_info["owner"]["_account_id"],
+        src.comment_info["author"]["_account_id"]
+    ))
+
+
+def _columns(prefix: str, columns: list[Column]) -> Callable[[frozenset[str]], list[Column]]:
+    return lambda _: [c.prefixed(prefix) for c in columns]
+
+
+def _code_columns(prefix: str, columns: list[Column]) -> Callable[[frozenset[str]], list[Column]]:
+    # The blame metrics are a part of every code section (after its own columns), as in the features' index
+    return lambda groups: [c.prefixed(prefix) for c in columns + (BLAME_METRIC_COLUMNS if "blame" in groups else [])]
+
+
+@dataclass(frozen=True)
+class FeatureGroup:
+    name: str
+    columns: Callable[[frozenset[str]], list[Column]]
+    compute: Callable[[CommentSources, frozenset[str], FeatureRow], None]
+
+    all: ClassVar[list[FeatureGroup]]
+
+
+META_COLUMNS = [
+    Column("meta.comment_id", "object"),
+    Column("meta.url", "object"),
+    Column("meta.label", "object"),
+    Column("meta.start_line", "float64"),  # None for file comments
+    Column("meta.end_line", "float64"),
+]
+
+FeatureGroup.all = [
+    FeatureGroup("comment", _columns("comment", [
+        Column("text", "object"),
+        Column("side", "object"),
+        Column("len", "int64"),
+    ]), _comment),
+    FeatureGroup("code.old", _code_columns("code.old", CODE_METRIC_COLUMNS), _code_old),
+    FeatureGroup("code.new", _code_columns("code.new", CODE_METRIC_COLUMNS), _code_new),
+    FeatureGroup("code.range", _code_columns("code.range", [
+        Column("text", "object"),
+        Column("volume", "float64"),
+        Column("len", "int64"),
+        Column("lines", "int64"),
+    ]), _code_range),
+    FeatureGroup("code.context", _code_columns("code.context", [
+        Column("text", "object"),
+        Column("volume", "float64"),
+        *CODE_METRIC_COLUMNS,
+    ]), _code_context),
+    FeatureGroup("code.diff", _code_columns("code.diff", CODE_METRIC_COLUMNS), _code_diff),
+    FeatureGroup("blame", lambda _: [], _blame),  # its columns are in the code groups
+    FeatureGroup("changes", _columns("changes", CHANGE_METRIC_COLUMNS), _changes),
+]
+
+FEATURE_GROUP_NAMES = [group.name for group in FeatureGroup.all]
+
+
+def get_feature_groups(names: Iterable[str] | None = None) -> list[FeatureGroup]:
+    if names is None:
+        return list(FeatureGroup.all)
+    names = set(names)
+    if unknown := names - set(FEATURE_GROUP_NAMES):
+        raise ValueError(f"Unknown feature groups: {', '.join(sorted(unknown))}")
+    return [group for group in FeatureGroup.all if group.name in names]
+
+
+def feature_schema(groups: list[FeatureGroup]) -> list[Column]:
+    names = frozenset(group.name for group in groups)
+    return [*META_COLUMNS, *(c for group in groups for c in group.columns(names))]
+
+
+def diff_features(old_features: dict[str, Any], new_features: dict[str, Any]) -> dict[str, Any]:
+    return {key: new_features[key] - old for key, old in old_features.items() if key in new_features}
+
+
+class TestFeatureGroups(TestCase):
+    def test_get_feature_groups(self):
+        self.assertEqual([g.name for g in get_feature_groups()], FEATURE_GROUP_NAMES)
+        self.assertEqual([g.name for g in get_feature_groups(["changes", "comment"])], ["comment", "changes"])
+        self.assertRaises(ValueError, lambda: get_feature_groups(["comment", "code.unknown"]))
+
+    def test_feature_schema(self):
+        schema = feature_schema(get_feature_groups(["comment", "code.range", "blame"]))
+        self.assertEqual([c.name for c in schema], [
+            "meta.comment_id", "meta.url", "meta.label", "meta.start_line", "meta.end_line",
+            "comment.text", "comment.side", "comment.len",
+            "code.range.text", "code.range.volume", "code.range.len", "code.range.lines",
+            "code.range.by_owner.lines", "code.range.by_owner.volume",
+            "code.range.by_reviewer.lines", "code.range.by_reviewer.volume",
+        ])
+        names = [c.name for c in feature_schema(get_feature_groups())]
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_blame_columns_in_code_sections(self):
+        names = [c.name for c in feature_schema(get_feature_groups(["code.old", "code.diff", "blame", "changes"]))]
+        for section in ["code.old", "code.diff"]:
+            section_names = [name for name in names if name.startswith(f"{section}.")]
+            # every section is contiguous and ends with its blame metrics
+            start = names.index(section_names[0])
+            self.assertEqual(names[start:start + len(section_names)], section_names)
+            self.assertEqual(section_names[-4:], [f"{section}.by_owner.lines", f"{section}.by_owner.volume",
+                                                  f"{section}.by_reviewer.lines", f"{section}.by_reviewer.volume"])
+        self.assertLess(names.index("code.diff.by_reviewer.volume"), names.index("changes.count"))
+
+    def test_diff_features(self):
+        self.assertEqual(diff_features(
+            {"a": 3, "b.c": 4, "b.d": 5},
+            {"a": 5, "b.c": 0}),
+            {"a": 2, "b.c": -4}
+        )
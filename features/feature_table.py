@@ -0,0 +1,114 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+    dtype: str
+
+    def prefixed(self, prefix: str) -> Column:
+        return Column(f"{prefix}.{self.name}", self.dtype)
+
+
+class FeatureTable:
+    """
+    Preallocated, typed column buffers for a fixed number of dataset rows.
+    Rows are written in place through `FeatureRow`, and only the rows marked as valid are emitted.
+    Writing distinct rows from multiple threads is safe.
+    """
+
+    def __init__(self, schema: list[Column], capacity: int) -> None:
+        self.schema = schema
+        self._columns = {c.name: FeatureTable._allocate(c.dtype, capacity) for c in schema}
+        self._valid = np.zeros(capacity, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self._valid)
+
+    def row(self, index: int) -> FeatureRow:
+        return FeatureRow(self, index)
+
+    def set_valid(self, index: int, valid: bool = True) -> None:
+        self._valid[index] = valid
+
+    def is_valid(self, index: int) -> bool:
+        return bool(self._valid[index])
+
+    @property
+    def valid_count(self) -> int:
+        return int(self._valid.sum())
+
+    def row_dict(self, index: int) -> dict[str, Any]:
+        return {name: FeatureTable._python(column[index]) for name, column in self._columns.items()}
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({name: column[self._valid] for name, column in self._columns.items()})
+
+    def _set(self, name: str, index: int, value: Any) -> None:
+        column = self._columns[name]
+        if value is None and column.dtype.kind == "f":
+            value = np.nan
+        column[index] = value
+
+    @staticmethod
+    def _allocate(dtype: str, capacity: int) -> np.ndarray:
+        if np.dtype(dtype).kind == "f":
+            return np.full(capacity, np.nan, dtype=dtype)
+        return np.zeros(capacity, dtype=dtype) if dtype != "object" else np.full(capacity, None, dtype=dtype)
+
+    @staticmethod
+    def _python(value: Any) -> Any:
+        return value.item() if isinstance(value, np.generic) else value
+
+
+class FeatureRow:
+    """A writer of a single `FeatureTable` row, optionally scoped to the columns with a given name prefix."""
+
+    def __init__(self, table: FeatureTable, index: int, prefix: str = "") -> None:
+        self._table = table
+        self._index = index
+        self._prefix = prefix
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        self._table._set(self._prefix + name, self._index, value)
+
+    def update(self, values: dict[str, Any]) -> None:
+        for name, value in values.items():
+            self[name] = value
+
+    def section(self, prefix: str) -> FeatureRow:
+        return FeatureRow(self._table, self._index, f"{self._prefix}{prefix}.")
+
+
+class TestFeatureTable(TestCase):
+    SCHEMA = [Column("meta.id", "object"), Column("meta.line", "float64"), Column("code.len", "int64")]
+
+    def test_write_rows(self):
+        table = FeatureTable(self.SCHEMA, 3)
+        for i, (line, length) in enumerate([(1, 10), (None, 20), (3, 30)]):
+            row = table.row(i)
+            row.section("meta").update({"id": f"c{i}", "line": line})
+            row["code.len"] = length
+        table.set_valid(0)
+        table.set_valid(1)
+
+        self.assertEqual(table.valid_count, 2)
+        self.assertEqual(table.row_dict(0), {"meta.id": "c0", "meta.line": 1.0, "code.len": 10})
+        df = table.to_frame()
+        self.assertEqual(list(df.columns), ["meta.id", "meta.line", "code.len"])
+        self.assertEqual(df["meta.id"].tolist(), ["c0", "c1"])
+        self.assertTrue(np.isnan(df["meta.line"][1]))
+        self.assertEqual(df["code.len"].dtype, np.int64)
+
+    def test_unknown_column(self):
+        table = FeatureTable(self.SCHEMA, 1)
+        self.assertRaises(KeyError, lambda: table.row(0).update({"code.unknown": 1}))
+
+    def test_prefixed(self):
+        self.assertEqual(Column("len", "int64").prefixed("code.old"), Column("code.old.len", "int64"))
@@ -0,0 +1,34 @@
+from typing import Sequence
+from unittest import TestCase
+
+from data.candidate_meta import CandidateMeta
+from features.comment_sources import FileSources
+
+
+def group_by_file(metas: Sequence[CandidateMeta]) -> list[list[int]]:
+    """
+    Groups the indices of comment metas by the (change, revision, file) they were left on.
+    Groups are ordered by their first occurrence, indices within a group keep the original order.
+    """
+    groups: dict[tuple[str, str, str], list[int]] = {}
+    for i, meta in enumerate(metas):
+        groups.setdefault(FileSources.key(meta), []).append(i)
+    return list(groups.values())
+
+
+class TestFileBatches(TestCase):
+    @staticmethod
+    def _meta(comment_id: str, change_number: str, file_path: str) -> CandidateMeta:
+        return CandidateMeta(comment_id=comment_id, revision_id="r", change_number=change_number,
+                             file_path=file_path, url="")
+
+    def test_group_by_file(self):
+        metas = [
+            self._meta("a", "1", "x.py"),
+            self._meta("b", "2", "x.py"),
+            self._meta("c", "1", "y.py"),
+            self._meta("d", "1", "x.py"),
+            self._meta("e", "2", "x.py"),
+        ]
+        self.assertEqual(group_by_file(metas), [[0, 3], [1, 4], [2]])
+        self.assertEqual(group_by_file([]), [])
@@ -0,0 +1,87 @@
+from __future__ import annotations
+from typing import Generic, TypeVar
+from unittest import TestCase
+
+T = TypeVar("T")
+
+
+class IntervalIndex(Generic[T]):
+    """
+    A static centered interval tree over closed integer intervals.
+    Answers which intervals contain a given range in O(log n + k) time, where k is the number of stabbed intervals.
+    """
+
+    def __init__(self, intervals: list[tuple[int, int, T]]) -> None:
+        self._center = 0
+        self._by_start: list[tuple[int, int, T]] = []
+        self._by_end: list[tuple[int, int, T]] = []
+        self._left: IntervalIndex[T] | None = None
+        self._right: IntervalIndex[T] | None = None
+        if len(intervals) == 0:
+            return
+
+        endpoints = sorted(p for start, end, _ in intervals for p in (start, end))
+        self._center = endpoints[len(endpoints) // 2]
+
+        left, right, center = [], [], []
+        for interval in intervals:
+            start, end, _ = interval
+            if end < self._center:
+                left.append(interval)
+            elif start > self._center:
+                right.append(interval)
+            else:
+                center.append(interval)
+
+        self._by_start = sorted(center, key=lambda i: i[0])
+        self._by_end = sorted(center, key=lambda i: -i[1])
+        self._left = IntervalIndex(left) if left else None
+        self._right = IntervalIndex(right) if right else None
+
+    def containing(self, start: int, end: int) -> list[T]:
+        """Returns the items of all intervals, which contain the entire [start, end] range (in no particular order)."""
+        return [item for s, e, item in self._stab(start) if e >= end]
+
+    def _stab(self, point: int) -> list[tuple[int, int, T]]:
+        result = []
+        node: IntervalIndex[T] | None = self
+        while node is not None:
+            if point < node._center:
+                for interval in node._by_start:
+                    if interval[0] > point:
+                        break
+                    result.append(interval)
+                node = node._left
+            elif point > node._center:
+                for interval in node._by_end:
+                    if interval[1] < point:
+                        break
+                    result.append(interval)
+                node = node._right
+            else:
+                result.extend(node._by_start)
+                node = None
+        return result
+
+
+class TestIntervalIndex(TestCase):
+    def test_containing(self):
+        index = IntervalIndex([(1, 10, "a"), (2, 4, "b"), (3, 3, "c"), (5, 9, "d"), (6, 20, "e"), (12, 12, "f")])
+
+        self.assertEqual(sorted(index.containing(3, 3)), ["a", "b", "c"])
+        self.assertEqual(sorted(index.containing(2, 4)), ["a", "b"])
+        self.assertEqual(sorted(index.containing(6, 9)), ["a", "d", "e"])
+        self.assertEqual(sorted(index.containing(12, 12)), ["e", "f"])
+        self.assertEqual(sorted(index.containing(9, 11)), ["e"])
+        self.assertEqual(index.containing(21, 21), [])
+
+    def test_empty(self):
+        self.assertEqual(IntervalIndex([]).containing(1, 1), [])
+
+    def test_brute_force(self):
+        intervals = [(s, s + (s * 7) % 13, i) for i, s in enumerate(range(0, 200, 3))]
+        index = IntervalIndex(intervals)
+        for start in range(-5, 230, 4):
+            for end in range(start, start + 15, 3):
+                expected = sorted(i for s, e, i in intervals if s <= start and end <= e)
+                self.assertEqual(sorted(index.containing(start, end)), expected)
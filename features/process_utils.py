@@ -2,6 +2,23 @@ from typing import Any
 
 from api.blame_info import BlameInfo
 from api.change_info import ChangeInfo
+from features.feature_table import Column
+
+BLAME_METRIC_COLUMNS = [
+    Column("by_owner.lines", "int64"),
+    Column("by_owner.volume", "float64"),
+    Column("by_reviewer.lines", "int64"),
+    Column("by_reviewer.volume", "float64"),
+]
+
+CHANGE_METRIC_COLUMNS = [
+    Column("count", "int64"),
+    Column("unique_authors", "int64"),
+    Column("by_owner.count", "int64"),
+    Column("by_owner.volume", "float64"),
+    Column("by_reviewer.count", "int64"),
+    Column("by_reviewer.volume", "float64"),
+]
 
 
 def calculate_blame_metrics(blame: list[BlameInfo], owner_name: str, reviewer_name: str, start_line: int | None = None, end_line: int | None = None) -> dict[str, Any]:
@@ -15,14 +32,10 @@ def calculate_blame_metrics(blame: list[BlameInfo], owner_name: str, reviewer_na
     reviewer_lines = _count_lines_by_account(blame, reviewer_name, start_line, end_line)
 
     return {
-        "by_owner": {
-            "lines": owner_lines,
-            "volume": owner_lines / all_lines if all_lines > 0 else 0
-        },
-        "by_reviewer": {
-            "lines": reviewer_lines,
-            "volume": reviewer_lines / all_lines if all_lines > 0 else 0
-        }
+        "by_owner.lines": owner_lines,
+        "by_owner.volume": owner_lines / all_lines if all_lines > 0 else 0.,
+        "by_reviewer.lines": reviewer_lines,
+        "by_reviewer.volume": reviewer_lines / all_lines if all_lines > 0 else 0.,
     }
 
 
@@ -51,12 +64,8 @@ def calculate_change_metrics(changes: list[ChangeInfo], owner_id: int, reviewer_
     return {
         "count": all_changes,
         "unique_authors": len({c["owner"]["_account_id"] for c in changes}),
-        "by_owner": {
-            "count": owner_changes,
-            "volume": owner_changes / all_changes if all_changes > 0 else 0
-        },
-        "by_reviewer": {
-            "count": reviewer_changes,
-            "volume": reviewer_changes / all_changes if all_changes > 0 else 0
-        }
+        "by_owner.count": owner_changes,
+        "by_owner.volume": owner_changes / all_changes if all_changes > 0 else 0.,
+        "by_reviewer.count": reviewer_changes,
+        "by_reviewer.volume": reviewer_changes / all_changes if all_changes > 0 else 0.,
     }
@@ -1,100 +1,116 @@
-import numpy as np
+import argparse
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+import joblib
 import pandas as pd
-from sklearn.base import BaseEstimator
-from sklearn.compose import make_column_selector, make_column_transformer
-from sklearn.discriminant_analysis import StandardScaler
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.feature_selection import SelectKBest, VarianceThreshold
-from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.feature_extraction.text import TfidfVectorizer
-from imblearn.base import BaseSampler
 from imblearn.over_sampling import RandomOverSampler, SMOTE, ADASYN
 from imblearn.combine import SMOTETomek, SMOTEENN
+from openpyxl import load_workbook
 from supervised.automl import AutoML
 
 from features.comment_groups import add_comment_group_metrics
-from simple.evaluation import evaluate
-
-SEED = 1
-META_COLS = ["meta.comment_id", "meta.url", "meta.label", "meta.start_line", "meta.end_line"]
-LABEL_COL = "meta.label"
-TEXTUAL_COL = "comment.text"
-CATEGORICAL_COLS = ["comment.side"]
-
-
-def load_dataset() -> tuple[pd.DataFrame, pd.Series]:
-    df = pd.read_excel("dataset.xlsx")
-    df = df.sample(frac=1, random_state=SEED).reset_index(drop=True)
-    add_comment_group_metrics(df)
-    return df.drop(columns=META_COLS), df[LABEL_COL]
-
-
-class Simple(BaseEstimator):
-    def __init__(self) -> None:
-        self._pipeline = make_pipeline(
-            make_column_transformer(
-                (OneHotEncoder(), CATEGORICAL_COLS),
-                (TfidfVectorizer(stop_words="english", sublinear_tf=True), TEXTUAL_COL),
-                (StandardScaler(), make_column_selector(dtype_include="number")),
-            ),
-            VarianceThreshold(),
-            SelectKBest(k=32),
-            RandomForestClassifier(random_state=SEED),
-        )
-
-    def fit(self, X, y):
-        self._pipeline.fit(X, y)
-        return self
-
-    def predict(self, X):
-        return self._pipeline.predict(X)
-
-
-class Sampled(Simple):
-    def __init__(self, sampler: BaseSampler) -> None:
-        self._sampler = sampler
-        self._pipeline = make_pipeline(
-            StandardScaler(),
-            VarianceThreshold(),
-            SelectKBest(k=32),
-            RandomForestClassifier(random_state=SEED),
-        )
-
-    def fit(self, X, y):
-        X = Sampled._numericize(X)
-        X, y = self._sampler.fit_resample(X, y)
-        return super().fit(X, y)
-
-    def predict(self, X):
-        return super().predict(Sampled._numericize(X))
-
-    @staticmethod
-    def _numericize(X):
-        X = X.copy()
-        for col in CATEGORICAL_COLS:
-            X[col] = X[col].astype("category").cat.codes
-        return X.select_dtypes([np.number])
+from simple.experiments import Experiment, run_experiments
+from simple.models import SEED, TEXTUAL_COL, Sampled, Simple, reduce_pipeline_cache
+from simple.training import DEFAULT_MODEL_PATH, load_dataset, train
+
+DEFAULT_PREDICTIONS_PATH = "predictions.csv"
+DEFAULT_CHUNK_SIZE = 10000
+ID_COL = "meta.comment_id"
+PREDICTION_COL = "prediction"
+
+
+def experiments(size: int) -> list[Experiment]:
+    return [
+        Experiment("base", Simple()),
+        *[Experiment(f"oversampling with {Sampler.__name__}", Sampled(sampler=Sampler(random_state=SEED)))
+          for Sampler in [RandomOverSampler, SMOTE, ADASYN, SMOTETomek, SMOTEENN]],
+        *[Experiment(f"base with n={int(size * percent / 100)}", Simple(), rows=int(size * percent / 100))
+          for percent in range(25, 101, 25)],
+        *[Experiment(f"AutoML with {mode=}", AutoML(mode=mode, max_single_prediction_time=None, random_state=SEED))
+          for mode in ["Perform", "Compete", "Optuna"]],
+    ]
+
+
+def read_features(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Reads a features file (.csv or .xlsx) in chunks of `chunk_size` rows, without loading all of it."""
+    if Path(path).suffix.lower() == ".csv":
+        yield from pd.read_csv(path, chunksize=chunk_size)
+        return
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows)
+        while chunk := list(islice(rows, chunk_size)):
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def predict_file(model: Simple, columns: list[str], features_path: str, output_path: str,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Classifies the comments of a features file chunk by chunk, appending the predictions of every chunk
+    to a CSV file, so that only one chunk is in memory at a time. Returns the number of classified comments.
+    """
+    count = 0
+    for i, df in enumerate(read_features(features_path, chunk_size)):
+        df[TEXTUAL_COL] = df[TEXTUAL_COL].fillna("").astype(str)
+        add_comment_group_metrics(df)
+        predictions = pd.DataFrame({PREDICTION_COL: model.predict(df.reindex(columns=columns))})
+        if ID_COL in df.columns:
+            predictions.insert(0, ID_COL, df[ID_COL].to_numpy())
+        predictions.to_csv(output_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+        count += len(df)
+        print(f"Classified {count} comments", end="\r")
+    print()
+    return count
+
+
+def _positive_int(value: str) -> int:
+    if (number := int(value)) <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def read_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("python -m simple",
+                                     description="Cross-validate the simple models (by default), or fit the model "
+                                                 "and classify features files with it")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    train_parser = commands.add_parser("train", help="Fit the model on dataset.xlsx and persist it")
+    train_parser.add_argument("-m", "--model", default=DEFAULT_MODEL_PATH, metavar="M",
+                              help="Path to persist the model to")
+    predict_parser = commands.add_parser("predict", help="Classify the comments of a features file")
+    predict_parser.add_argument("features", metavar="FEATURES",
+                                help="Features file (.csv or .xlsx) in the format of the dataset, with or without "
+                                     "the meta columns")
+    predict_parser.add_argument("-m", "--model", default=DEFAULT_MODEL_PATH, metavar="M",
+                                help="Path of the persisted model")
+    predict_parser.add_argument("-o", "--output", default=DEFAULT_PREDICTIONS_PATH, metavar="O",
+                                help="Path of the CSV file of the predictions")
+    predict_parser.add_argument("-c", "--chunk_size", type=_positive_int, default=DEFAULT_CHUNK_SIZE, metavar="C",
+                                help="Number of rows to read and classify at a time")
+    return parser.parse_args()
 
 
 def main():
-    X, y = load_dataset()
-
-    print("Evaluating base:")
-    evaluate(X, y, Simple, random_state=SEED)
-
-    for Sampler in [RandomOverSampler, SMOTE, ADASYN, SMOTETomek, SMOTEENN]:
-        print(f"Evaluating oversampling with {Sampler.__name__}:")
-        evaluate(X, y, lambda: Sampled(sampler=Sampler(random_state=SEED)), random_state=SEED)
-
-    for percent in range(25, 101, 25):
-        n = int(len(X) * percent / 100)
-        print(f"Evaluating base with {n=}:")
-        evaluate(X.head(n), y.head(n), Simple, random_state=SEED)
-
-    for mode in ["Perform", "Compete", "Optuna"]:
-        print(f"Evaluating AutoML with {mode=}:")
-        evaluate(X, y, lambda: AutoML(mode=mode, max_single_prediction_time=None, random_state=SEED), random_state=SEED)
+    args = read_args()
+    if args.command == "train":
+        train(args.model)
+        print(f"Saved the model to {args.model}")
+    elif args.command == "predict":
+        model, columns = joblib.load(args.model)
+        predict_file(model, columns, args.features, args.output, args.chunk_size)
+        print(f"Saved the predictions to {args.output}")
+    else:
+        X, y = load_dataset()
+        try:
+            run_experiments(experiments(len(X)), X, y, random_state=SEED)
+        finally:
+            reduce_pipeline_cache()
 
 
 if __name__ == "__main__":
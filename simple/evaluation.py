@@ -1,26 +1,107 @@
-from typing import Callable
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterator
+import joblib
+import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed
 from sklearn.base import BaseEstimator
-from sklearn.metrics import accuracy_score, matthews_corrcoef
 from sklearn.model_selection import KFold
+from supervised.automl import AutoML
+from threadpoolctl import threadpool_limits
 from tqdm import tqdm
 
+from data.metrics import bootstrap_intervals, confusion_matrix, scores
+
 FOLDS = 10
 
+_shared_data: dict[str, tuple[pd.DataFrame, pd.Series]] = {}  # the data loaded by a worker process, by path
+
+
+def evaluate(X: pd.DataFrame, y: pd.Series, model_factory: Callable[[], BaseEstimator], random_state: int | None = None,
+             n_jobs: int | None = None) -> dict[str, float | list[float]]:
+    """
+    Cross-validates the models created by `model_factory`, fitting the folds in up to `n_jobs` processes
+    (by default, one per core). The data is written to a memory-mapped file once, instead of being sent to every fold.
+    """
+    [(_, results)] = evaluate_many(X, y, [(model_factory, len(X))], random_state, n_jobs)
+    print(format_results(results))
+    return results
 
-def evaluate(X: pd.DataFrame, y: pd.Series, model_factory: Callable[[], BaseEstimator], random_state: int | None = None) -> None:
+
+def evaluate_many(X: pd.DataFrame, y: pd.Series, models: list[tuple[Callable[[], BaseEstimator], int]],
+                  random_state: int | None = None, n_jobs: int | None = None
+                  ) -> Iterator[tuple[int, dict[str, float | list[float]]]]:
+    """
+    Cross-validates several models, each on the given number of first rows, scheduling the folds of all of them
+    in one pool. The index and results of every model are yielded as soon as all of its folds are done.
+    """
+    n_jobs = min(FOLDS * len(models), n_jobs or os.cpu_count() or 1)
+    # The cores are split between the folds, so that the models' own thread pools do not oversubscribe them
+    threads = max(1, (os.cpu_count() or 1) // n_jobs)
     fold = KFold(n_splits=FOLDS, shuffle=True, random_state=random_state)
-    acc_sum, mcc_sum, count = 0, 0, 0
-    for train_idx, valid_idx in tqdm(fold.split(X), total=FOLDS, leave=False):
-        X_train, y_train = X.loc[train_idx, :], y.loc[train_idx]
-        X_valid, y_valid = X.loc[valid_idx, :], y.loc[valid_idx]
+    classes = [np.unique(y.iloc[:rows]) for _, rows in models]
+    matrices: list[list[np.ndarray]] = [[] for _ in models]
+
+    directory = Path(tempfile.mkdtemp(prefix="evaluation"))
+    try:
+        path = str(directory / "data.joblib")
+        joblib.dump((X, y), path)
+        tasks = Parallel(n_jobs=n_jobs, return_as="generator_unordered")(
+            delayed(_evaluate_fold)(path, train_idx, valid_idx, model_factory, classes[model], threads, model)
+            for model, (model_factory, rows) in enumerate(models)
+            for train_idx, valid_idx in fold.split(np.arange(rows)))
+        for model, matrix in tqdm(tasks, total=FOLDS * len(models), leave=False):
+            matrices[model].append(matrix)
+            if len(matrices[model]) == FOLDS:
+                yield model, _results(matrices[model], random_state)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def format_results(results: dict[str, float | list[float]]) -> str:
+    return (f"ACC: {results['accuracy']:.3f} [{results['accuracy_interval'][0]:.3f}, "
+            f"{results['accuracy_interval'][1]:.3f}], "
+            f"MCC: {results['mcc']:.3f} [{results['mcc_interval'][0]:.3f}, {results['mcc_interval'][1]:.3f}]")
+
+
+def _results(matrices: list[np.ndarray], random_state: int | None) -> dict[str, float | list[float]]:
+    fold_scores = [scores(matrix) for matrix in matrices]
+    # The intervals are of the out-of-fold predictions of all folds together
+    intervals = bootstrap_intervals(np.sum(matrices, axis=0), np.random.default_rng(random_state))
+    return {**{metric: float(np.mean([fold_score[metric] for fold_score in fold_scores]))
+               for metric in ["accuracy", "mcc"]},
+            **{f"{metric}_interval": [float(bound) for bound in intervals[metric]] for metric in ["accuracy", "mcc"]}}
+
+
+def _evaluate_fold(path: str, train_idx: np.ndarray, valid_idx: np.ndarray,
+                   model_factory: Callable[[], BaseEstimator], classes: np.ndarray, threads: int,
+                   model: int) -> tuple[int, np.ndarray]:
+    if path not in _shared_data:
+        _shared_data.clear()
+        # The numeric columns are mapped from the file, which all processes share through the page cache
+        _shared_data[path] = joblib.load(path, mmap_mode="r")
+    X, y = _shared_data[path]
 
-        model = model_factory()
-        model.fit(X_train, y_train)
-        y_pred = model.predict(X_valid)
+    X_train, y_train = X.iloc[train_idx, :], y.iloc[train_idx]
+    X_valid, y_valid = X.iloc[valid_idx, :], y.iloc[valid_idx]
 
-        acc_sum += accuracy_score(y_valid, y_pred)
-        mcc_sum += matthews_corrcoef(y_valid, y_pred)
-        count += 1
+    clf = model_factory()
+    results_path = None
+    if isinstance(clf, AutoML):
+        # AutoML would otherwise pick the next free AutoML_<n> directory, which folds fitted at the same time can
+        # share, and its own workers would ignore the thread limit
+        results_path = tempfile.mkdtemp(prefix="evaluation")
+        clf.set_params(results_path=str(Path(results_path) / "automl"), n_jobs=threads)
+    try:
+        with threadpool_limits(threads):
+            clf.fit(X_train, y_train)
+            y_pred = clf.predict(X_valid)
+    finally:
+        if results_path is not None:
+            shutil.rmtree(results_path, ignore_errors=True)
 
-    print(f"ACC: {acc_sum/count:.3f}, MCC: {mcc_sum/count:.3f}")
+    return model, confusion_matrix(np.searchsorted(classes, y_valid), np.searchsorted(classes, y_pred),
+                                   len(classes))
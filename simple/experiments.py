@@ -0,0 +1,79 @@
+import copy
+import json
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+
+import joblib
+import pandas as pd
+from sklearn.base import BaseEstimator
+
+from simple.evaluation import FOLDS, evaluate_many, format_results
+
+_CACHE_DIR = Path(__file__).parent.resolve() / "__experimentcache__"
+
+
+@dataclass(frozen=True)
+class Experiment:
+    name: str
+    model: BaseEstimator  # an unfitted prototype, which is copied for every fold
+    rows: int | None = None  # the number of first rows of the dataset to evaluate on, or all of them
+
+
+def run_experiments(experiments: list[Experiment], X: pd.DataFrame, y: pd.Series, random_state: int | None = None,
+                    n_jobs: int | None = None) -> dict[str, dict[str, float | list[float]]]:
+    """
+    Cross-validates the experiments, scheduling the folds of all of them in one pool. The results are cached by
+    a hash of the model's class and parameters, the evaluated rows of the dataset and the folds, so that a rerun
+    only evaluates the experiments that were changed, added or interrupted.
+    """
+    keys = {}
+    cached_results = {}
+    pending: dict[str, tuple[Experiment, int]] = {}  # identical experiments are only evaluated once
+    for experiment in experiments:
+        rows = len(X) if experiment.rows is None else experiment.rows
+        keys[experiment.name] = key = joblib.hash((_describe(experiment.model), X.head(rows), y.head(rows), FOLDS,
+                                                   random_state))
+        if (cached := _load_cached(key)) is not None:
+            print(f"{experiment.name}: {format_results(cached)} (cached)")
+            cached_results[key] = cached
+        elif key not in pending:
+            pending[key] = experiment, rows
+
+    if pending:
+        models = [(partial(copy.deepcopy, experiment.model), rows) for experiment, rows in pending.values()]
+        for i, results in evaluate_many(X, y, models, random_state, n_jobs):
+            key, (experiment, _) = list(pending.items())[i]
+            print(f"{experiment.name}: {format_results(results)}")
+            _store_cached(key, experiment.name, results)
+            cached_results[key] = results
+    return {experiment.name: cached_results[keys[experiment.name]] for experiment in experiments}
+
+
+def _describe(model: BaseEstimator) -> list:
+    """
+    The class and parameters of the unfitted model, which unlike its pickle are the same in every run
+    (e.g. AutoML's pickle holds a random id and its creation time). The pipeline of a `simple.models` model
+    is described by its parameters too, as they are not the model's own.
+    """
+    description = [type(model).__module__, type(model).__qualname__, model.get_params(deep=True)]
+    if isinstance(pipeline := getattr(model, "_pipeline", None), BaseEstimator):
+        description.append(pipeline.get_params(deep=True))
+    return description
+
+
+def _load_cached(key: str) -> dict[str, float | list[float]] | None:
+    try:
+        return json.loads((_CACHE_DIR / f"{key}.json").read_text())["results"]
+    except:
+        return None
+
+
+def _store_cached(key: str, name: str, results: dict[str, float | list[float]]) -> None:
+    try:
+        _CACHE_DIR.mkdir(exist_ok=True)
+        tmp_path = _CACHE_DIR / f"{key}.tmp.json"
+        tmp_path.write_text(json.dumps({"name": name, "results": results}, indent=2))
+        tmp_path.replace(_CACHE_DIR / f"{key}.json")
+    except:
+        pass  # the cache's only purpose is to speed up performance, so we can ignore any errors
@@ -1,11 +1,22 @@
+import argparse
+import json
+import math
+import os
+import time
+from hashlib import sha3_256
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
-from sklearn.base import BaseEstimator
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, clone
 from sklearn.discriminant_analysis import StandardScaler
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.feature_selection import SelectKBest, VarianceThreshold
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GridSearchCV, ParameterGrid, StratifiedKFold
 from sklearn.pipeline import Pipeline, make_pipeline
 from sklearn.svm import SVC
+from threadpoolctl import threadpool_limits
 from catboost import CatBoostClassifier
 
 from features.comment_groups import add_comment_group_metrics
@@ -17,19 +28,68 @@ EXCLUDED_COLS = ["meta.comment_id", "meta.url", "meta.label",
                  "comment.side", "code.range.text", "code.context.text"]
 LABEL_COL = "meta.label"
 
+CV_FOLDS = 5
+HALVING_FACTOR = 3
+MIN_RESOURCES = 100  # training samples per fold of the first round of successive halving
+DEFAULT_TRIALS_PATH = "hyperopt_trials.jsonl"
 
-def main() -> None:
-    df = pd.read_excel("dataset.xlsx")
-    add_comment_group_metrics(df)
-    X = df.drop(columns=EXCLUDED_COLS).to_numpy()
-    y = df[LABEL_COL].astype("category")
+# The classifiers are single-threaded, the parallelism is across the candidates (and folds)
+PARAM_GRID = [
+    {
+        "clf": [RandomForestClassifier()],
+        "clf__random_state": [SEED],
+
+        "clf__n_estimators": [50, 100, 250, 500],
+        "clf__criterion": ["gini", "entropy"],
+        "clf__max_depth": [3, 6, 9, None],
+        "clf__max_features": ["sqrt", "log2", None]
+    },
+    {
+        "clf": [SVC()],
+        "clf__random_state": [SEED],
+
+        "clf__C": [0.1, 1, 10, 100],
+        "clf__kernel": ["poly", "rbf", "sigmoid"],
+        "clf__gamma": ["scale", "auto"]
+    },
+    {
+        "clf": [CatBoostClassifier()],
+        "clf__random_state": [SEED],
+        "clf__verbose": [False],
+        "clf__allow_writing_files": [False],
+        "clf__thread_count": [1],
+    }
+]
+
+
+def read_args() -> tuple[str, float | None, str, int | None]:
+    parser = argparse.ArgumentParser("python -m simple.hyperopt",
+                                     description="Search the hyperparameters of the classifier of the simple model")
+    parser.add_argument("--search", choices=["halving", "grid"], default="halving",
+                        help="Successive halving under an optional time budget, or an exhaustive grid search")
+    parser.add_argument("--budget", type=float, default=None, metavar="SECONDS",
+                        help="Wall-clock budget of the successive halving, after which the best candidate so far "
+                             "is taken")
+    parser.add_argument("--trials", default=DEFAULT_TRIALS_PATH, metavar="PATH",
+                        help="File of the successive halving's trial results, from which an interrupted search "
+                             "resumes")
+    parser.add_argument("-j", "--jobs", type=int, default=None, metavar="J",
+                        help="Number of parallel trials (default: one per core)")
+    args = parser.parse_args()
+    return args.search, args.budget, args.trials, args.jobs
+
+
+def make_preprocessing() -> Pipeline:
+    return make_pipeline(
+        VarianceThreshold(),
+        StandardScaler(),
+        SelectKBest(k=50)
+    )
 
+
+def grid_search(X: np.ndarray, y: pd.Series, n_jobs: int | None) -> tuple[list[tuple[dict, float]], BaseEstimator]:
     model = Pipeline([
-        ("pre", make_pipeline(
-            VarianceThreshold(),
-            StandardScaler(),
-            SelectKBest(k=50)
-        )),
+        ("pre", make_preprocessing()),
         ("clf", BaseEstimator())
     ])
 
@@ -37,40 +97,164 @@ def main() -> None:
         estimator=model,
         scoring="accuracy",
         verbose=50,
-        n_jobs=-1,
-        param_grid=[
-            {
-                "clf": [RandomForestClassifier()],
-                "clf__random_state": [SEED],
-                "clf__n_jobs": [-1],
-
-                "clf__n_estimators": [50, 100, 250, 500],
-                "clf__criterion": ["gini", "entropy"],
-                "clf__max_depth": [3, 6, 9, None],
-                "clf__max_features": ["sqrt", "log2", None]
-            },
-            {
-                "clf": [SVC()],
-                "clf__random_state": [SEED],
-
-                "clf__C": [0.1, 1, 10, 100],
-                "clf__kernel": ["poly", "rbf", "sigmoid"],
-                "clf__gamma": ["scale", "auto"]
-            },
-            {
-                "clf": [CatBoostClassifier()],
-                "clf__random_state": [SEED],
-                "clf__verbose": [False],
-                "clf__allow_writing_files": [False],
-            }
-        ])
+        n_jobs=n_jobs or -1,
+        param_grid=PARAM_GRID)
 
     grid.fit(X, y)
-    res = pd.DataFrame(grid.cv_results_)[["params", "mean_test_score"]
-                                         ].sort_values("mean_test_score", ascending=False).head(10)
-    for _, r in res.iterrows():
-        print(f"{r['params']} -> {r['mean_test_score']:.2f}")
-    clf = grid.best_estimator_
+    res = pd.DataFrame(grid.cv_results_)[["params", "mean_test_score"]]
+    return list(zip(res["params"], res["mean_test_score"])), grid.best_estimator_
+
+
+def halving_search(X: np.ndarray, y: pd.Series, budget: float | None, trials_path: str,
+                   n_jobs: int | None) -> tuple[list[tuple[dict, float]], BaseEstimator]:
+    """
+    Successive halving: all candidates are trained on a subsample of every fold's training samples, and only the best
+    third of them is trained again on three times as many samples, until the best candidates are trained on all
+    of them. The preprocessing is fitted once per fold. Every trial's result is appended to `trials_path`,
+    so that an interrupted search resumes where it stopped.
+    """
+    start = time.perf_counter()
+    codes = y.cat.codes.to_numpy()
+    candidates = all_candidates = list(ParameterGrid(PARAM_GRID))
+    folds = _preprocess_folds(X, codes)
+
+    max_resources = min(len(y_train) for _, y_train, _, _ in folds)
+    rounds = max(1, min(math.ceil(math.log(len(candidates), HALVING_FACTOR)),
+                        int(math.log(max_resources / MIN_RESOURCES, HALVING_FACTOR)) + 1))
+
+    dataset = _dataset_hash(X, codes)
+    trials = _load_trials(trials_path, dataset)
+    n_jobs = n_jobs or os.cpu_count() or 1
+    results = []
+    with open(trials_path, "a") as trials_file, Parallel(n_jobs=n_jobs, return_as="generator_unordered") as parallel:
+        for i in range(rounds):
+            resources = max_resources // HALVING_FACTOR ** (rounds - 1 - i)
+            pending = [(candidate, fold) for candidate in range(len(candidates)) for fold in range(CV_FOLDS)
+                       if (_candidate_key(candidates[candidate]), resources, fold) not in trials]
+            print(f"Round {i + 1}/{rounds}: {len(candidates)} candidates on {resources} samples per fold, "
+                  f"{len(pending)} trials to run")
+
+            out_of_budget = False
+            for candidate, fold, score in parallel(
+                    delayed(_run_trial)(candidates[candidate], *folds[fold], resources, candidate, fold)
+                    for candidate, fold in pending):
+                key = (_candidate_key(candidates[candidate]), resources, fold)
+                trials[key] = score
+                trials_file.write(json.dumps({"dataset": dataset, "candidate": key[0], "resources": resources,
+                                              "fold": fold, "score": score}) + "\n")
+                trials_file.flush()
+                if budget is not None and time.perf_counter() - start > budget:
+                    out_of_budget = True
+                    break
+
+            scored = [(candidate, np.mean(fold_scores)) for candidate in candidates
+                      if len(fold_scores := [trials[(_candidate_key(candidate), resources, fold)]
+                                             for fold in range(CV_FOLDS)
+                                             if (_candidate_key(candidate), resources, fold) in trials]) == CV_FOLDS]
+            if scored:
+                results = sorted(scored, key=lambda result: result[1], reverse=True)
+            if out_of_budget:
+                print(f"The budget of {budget:.0f} s is used up, taking the best candidate so far")
+                break
+            candidates = [candidate for candidate, _ in results[:max(1, len(results) // HALVING_FACTOR)]]
+
+    if not results:
+        # Not even the first round finished, so the candidates are ranked by the folds they were evaluated on
+        results = _partial_results(trials, all_candidates)
+        if not results:
+            raise RuntimeError(f"No trial finished within the budget of {budget:.0f} s")
+        print(f"No candidate was evaluated on all folds, taking the best of {len(results)} partially evaluated ones")
+    best = results[0][0]
+    model = Pipeline([
+        ("pre", make_preprocessing()),
+        ("clf", _make_classifier(best))
+    ])
+    return results, model
+
+
+def _partial_results(trials: dict[tuple[str, int, int], float], candidates: list[dict]) -> list[tuple[dict, float]]:
+    """The candidates with finished trials, by the mean score of their trials on the most samples, best first."""
+    scores: dict[str, tuple[int, list[float]]] = {}
+    for (key, resources, _), score in trials.items():
+        if key not in scores or resources > scores[key][0]:
+            scores[key] = resources, []
+        if resources == scores[key][0]:
+            scores[key][1].append(score)
+    results = [(candidate, scores[key][0], float(np.mean(scores[key][1]))) for candidate in candidates
+               if (key := _candidate_key(candidate)) in scores]
+    return [(candidate, score)
+            for candidate, _, score in sorted(results, key=lambda result: result[1:], reverse=True)]
+
+
+def _preprocess_folds(X: np.ndarray, codes: np.ndarray) -> list[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """Fits the preprocessing once per fold, returning the preprocessed training and validation data of every fold."""
+    folds = []
+    rng = np.random.default_rng(SEED)
+    for train_idx, valid_idx in StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=SEED).split(X, codes):
+        preprocessing = make_preprocessing().fit(X[train_idx], codes[train_idx])
+        X_train = preprocessing.transform(X[train_idx])
+        X_valid = preprocessing.transform(X[valid_idx])
+        # The subsamples of the successive rounds are prefixes of the same order, so they are nested
+        order = rng.permutation(len(train_idx))
+        folds.append((np.ascontiguousarray(X_train[order]), codes[train_idx][order], X_valid, codes[valid_idx]))
+    return folds
+
+
+def _run_trial(params: dict, X_train: np.ndarray, y_train: np.ndarray, X_valid: np.ndarray, y_valid: np.ndarray,
+               resources: int, candidate: int, fold: int) -> tuple[int, int, float]:
+    with threadpool_limits(1):
+        clf = _make_classifier(params).fit(X_train[:resources], y_train[:resources])
+        predicted = np.asarray(clf.predict(X_valid)).ravel()
+    return candidate, fold, float(np.mean(predicted == y_valid))
+
+
+def _make_classifier(params: dict) -> BaseEstimator:
+    return clone(params["clf"]).set_params(**{name.removeprefix("clf__"): value
+                                              for name, value in params.items() if name != "clf"})
+
+
+def _candidate_key(params: dict) -> str:
+    return repr(sorted(params.items(), key=lambda item: item[0]))
+
+
+def _dataset_hash(X: np.ndarray, codes: np.ndarray) -> str:
+    digest = sha3_256(np.ascontiguousarray(X).tobytes())
+    digest.update(np.ascontiguousarray(codes).tobytes())
+    return digest.hexdigest()
+
+
+def _load_trials(path: str, dataset: str) -> dict[tuple[str, int, int], float]:
+    trials = {}
+    if Path(path).exists():
+        content = Path(path).read_bytes()
+        if content and not content.endswith(b"\n"):
+            # The last trial of an interrupted run may be written partially; it is dropped (and run again),
+            # so that the next trial is appended on a line of its own
+            content = content[:content.rfind(b"\n") + 1]
+            with open(path, "r+b") as file:
+                file.truncate(len(content))
+        for line in content.decode().splitlines():
+            if line and (trial := json.loads(line))["dataset"] == dataset:
+                trials[(trial["candidate"], trial["resources"], trial["fold"])] = trial["score"]
+        print(f"Resuming with {len(trials)} trials from {path}")
+    return trials
+
+
+def main() -> None:
+    search, budget, trials_path, n_jobs = read_args()
+
+    df = pd.read_excel("dataset.xlsx")
+    add_comment_group_metrics(df)
+    X = df.drop(columns=EXCLUDED_COLS).to_numpy()
+    y = df[LABEL_COL].astype("category")
+
+    if search == "grid":
+        res, clf = grid_search(X, y, n_jobs)
+    else:
+        res, clf = halving_search(X, y, budget, trials_path, n_jobs)
+
+    for params, score in sorted(res, key=lambda result: result[1], reverse=True)[:10]:
+        print(f"{params} -> {score:.2f}")
     evaluate(pd.DataFrame(X), y, lambda: clf, random_state=SEED)
 
 
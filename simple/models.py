@@ -0,0 +1,77 @@
+from pathlib import Path
+
+import numpy as np
+from joblib import Memory
+from sklearn.base import BaseEstimator
+from sklearn.compose import make_column_selector, make_column_transformer
+from sklearn.discriminant_analysis import StandardScaler
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_selection import SelectKBest, VarianceThreshold
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder, OrdinalEncoder
+from sklearn.feature_extraction.text import TfidfVectorizer
+from imblearn.base import BaseSampler
+from imblearn.pipeline import make_pipeline as make_sampling_pipeline
+
+SEED = 1
+TEXTUAL_COL = "comment.text"
+CATEGORICAL_COLS = ["comment.side"]
+# The fitted preprocessing stages and their outputs, by the stage's parameters and the content of its inputs
+PIPELINE_CACHE = Memory(Path(__file__).parent.resolve() / "__pipelinecache__", verbose=0)
+PIPELINE_CACHE_LIMIT = "2G"  # the least recently used entries beyond it are removed by `reduce_pipeline_cache`
+
+
+def make_float32() -> FunctionTransformer:
+    # The numeric columns are converted to float32 once, as all stages of the pipelines preserve float32
+    return FunctionTransformer(np.asarray, kw_args={"dtype": np.float32})
+
+
+def reduce_pipeline_cache() -> None:
+    """Removes the least recently used entries of the pipeline cache, which otherwise grows with every fit."""
+    try:
+        PIPELINE_CACHE.reduce_size(bytes_limit=PIPELINE_CACHE_LIMIT)
+    except:
+        pass  # the cache's only purpose is to speed up performance, so we can ignore any errors
+
+
+class Simple(BaseEstimator):
+    def __init__(self) -> None:
+        self._pipeline = make_pipeline(
+            # The features stay sparse (CSR) until the forest, which only needs the selected columns
+            make_column_transformer(
+                (OneHotEncoder(dtype=np.float32), CATEGORICAL_COLS),
+                (TfidfVectorizer(stop_words="english", sublinear_tf=True, dtype=np.float32), TEXTUAL_COL),
+                (make_pipeline(make_float32(), StandardScaler()), make_column_selector(dtype_include="number")),
+                sparse_threshold=1.0,
+            ),
+            VarianceThreshold(),
+            SelectKBest(k=32),
+            RandomForestClassifier(random_state=SEED),
+            memory=PIPELINE_CACHE,
+        )
+
+    def fit(self, X, y):
+        self._pipeline.fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self._pipeline.predict(X)
+
+
+class Sampled(Simple):
+    def __init__(self, sampler: BaseSampler) -> None:
+        self.sampler = sampler
+        # The samples are resampled after the preprocessing, which is thus shared by all samplers
+        self._pipeline = make_sampling_pipeline(
+            make_column_transformer(
+                (OrdinalEncoder(dtype=np.float32, handle_unknown="use_encoded_value", unknown_value=-1),
+                 CATEGORICAL_COLS),
+                (make_float32(), make_column_selector(dtype_include="number")),
+            ),
+            StandardScaler(),
+            VarianceThreshold(),
+            SelectKBest(k=32),
+            sampler,
+            RandomForestClassifier(random_state=SEED),
+            memory=PIPELINE_CACHE,
+        )
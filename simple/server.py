@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from fastapi import FastAPI, HTTPException
+from joblib import Parallel, delayed
+import uvicorn
+
+from api.api_cache import ApiCache
+from api.gerrit_api import GerritApi
+from data.candidate_meta import CandidateMeta
+from data.comment_meta import CommentMeta, load_comment_metas_from_dataset
+from features.comment_groups import add_comment_group_metrics
+from features.feature_extractor import FeatureExtractor
+from features.feature_table import FeatureTable
+from features.file_batches import group_by_file
+from simple.models import Simple
+from simple.training import DEFAULT_MODEL_PATH, META_COLS, train
+
+LABELED_DATASET_PATH = "labels/turzo2023_dataset.xlsx"
+MAX_BATCH_SIZE = 32
+MAX_BATCH_DELAY = 0.05  # seconds to wait for more comments before a batch is classified
+LATENCY_WINDOW = 1000  # number of the most recent requests the latency percentiles are computed from
+COMMENT_URL_PATTERN = re.compile(r"/\+/(\d+)/comment/([^/?#]+)")
+
+
+@dataclass(frozen=True, kw_only=True)
+class ClassifyDto:
+    comments: list[str]
+    """Comment ids (of the labeled dataset) or Gerrit comment links (https://.../c/<project>/+/<change>/comment/<id>)"""
+
+
+@dataclass(frozen=True, kw_only=True)
+class ClassificationDto:
+    comment: str
+    label: str | None
+
+
+@dataclass(frozen=True, kw_only=True)
+class StatsDto:
+    requestCount: int
+    latencyP50Ms: float
+    latencyP99Ms: float
+    meanBatchSize: float
+
+
+def load_model(path: str) -> tuple[Simple, list[str]]:
+    """Loads the persisted model and its input columns, or fits it on the dataset and persists it first."""
+    if Path(path).exists():
+        return joblib.load(path)
+
+    print(f"No model found at {path}, fitting it on the dataset...")
+    return train(path)
+
+
+class CommentResolver:
+    def __init__(self, api: GerritApi, known_metas: list[CandidateMeta]) -> None:
+        self._api = api
+        self._known_metas = {meta.comment_id: meta for meta in known_metas}
+
+    def resolve(self, comment: str) -> CandidateMeta | None:
+        if match := COMMENT_URL_PATTERN.search(comment):
+            return self._find_comment(*match.groups())
+        return self._known_metas.get(comment)
+
+    def _find_comment(self, change_number: str, comment_id: str) -> CandidateMeta | None:
+        for info in self._api.get_comments_for_change(change_number):
+            if info["id"] == comment_id:
+                return CandidateMeta(
+                    comment_id=comment_id,
+                    revision_id=info["commit_id"],
+                    change_number=change_number,
+                    file_path=info["path"],
+                    url=self._api.assemble_comment_url(int(change_number), info["patch_set"], info["path"],
+                                                       info.get("line", None)),
+                )
+        return None
+
+
+class Classifier:
+    def __init__(self, extractor: FeatureExtractor, model: Simple, columns: list[str]) -> None:
+        self._extractor = extractor
+        self._model = model
+        self._columns = columns
+
+    def classify(self, candidates: list[CandidateMeta]) -> list[str | None]:
+        """
+        Classifies the comments in a single model call. Comments whose features can't be extracted get None,
+        including the comments of a file whose extraction failed (e.g. on an HTTP or network error).
+        """
+        metas = [CommentMeta.of(candidate, None) for candidate in candidates]  # type: ignore[arg-type]
+        table = FeatureTable(self._extractor.schema, len(metas))
+        Parallel(n_jobs=-1, backend="threading")(
+            delayed(self._extract_file)([metas[i] for i in rows], table, rows)
+            for rows in group_by_file(metas))
+
+        valid = [i for i in range(len(metas)) if table.is_valid(i)]
+        labels: list[str | None] = [None] * len(metas)
+        if valid:
+            df = pd.DataFrame([table.row_dict(i) for i in valid])
+            add_comment_group_metrics(df)
+            X = df.drop(columns=META_COLS).reindex(columns=self._columns)
+            for i, label in zip(valid, self._model.predict(X)):
+                labels[i] = label
+        return labels
+
+    def _extract_file(self, metas: list[CommentMeta], table: FeatureTable, rows: list[int]) -> None:
+        try:
+            self._extractor.extract_file(metas, table, rows)
+        except Exception as e:
+            # The rows that weren't extracted stay invalid, so the other files of the batch (of other requests too)
+            # are still classified
+            print(f"Failed to extract the features of {metas[0].file_path}: {e!r}")
+
+
+class MicroBatcher:
+    """
+    Collects the comments of concurrent requests and classifies them together, in batches of up to
+    `MAX_BATCH_SIZE` comments, waiting at most `MAX_BATCH_DELAY` seconds for a batch to fill up.
+    """
+
+    def __init__(self, classifier: Classifier) -> None:
+        self._classifier = classifier
+        self._queue: asyncio.Queue[tuple[CandidateMeta, asyncio.Future[str | None]]] | None = None
+        self._task: asyncio.Task | None = None
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._batch_sizes: deque[int] = deque(maxlen=LATENCY_WINDOW)
+
+    async def classify(self, candidates: list[CandidateMeta]) -> list[str | None]:
+        start = time.perf_counter()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in candidates]
+        for candidate, future in zip(candidates, futures):
+            self._queue.put_nowait((candidate, future))
+        labels = list(await asyncio.gather(*futures))
+
+        self._latencies.append(time.perf_counter() - start)
+        return labels
+
+    @property
+    def stats(self) -> StatsDto:
+        latencies = np.array(self._latencies or [0.]) * 1000
+        return StatsDto(
+            requestCount=len(self._latencies),
+            latencyP50Ms=float(np.percentile(latencies, 50)),
+            latencyP99Ms=float(np.percentile(latencies, 99)),
+            meanBatchSize=float(np.mean(self._batch_sizes or [0])),
+        )
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + MAX_BATCH_DELAY
+            while len(batch) < MAX_BATCH_SIZE and (timeout := deadline - time.perf_counter()) > 0:
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self._batch_sizes.append(len(batch))
+            try:
+                labels = await asyncio.to_thread(self._classifier.classify, [candidate for candidate, _ in batch])
+                # The future of a request whose client disconnected is already cancelled
+                for (_, future), label in zip(batch, labels):
+                    if not future.done():
+                        future.set_result(label)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+def run_server(resolver: CommentResolver, batcher: MicroBatcher, port: int) -> None:
+    async def classify(request: ClassifyDto) -> list[ClassificationDto]:
+        candidates = await asyncio.gather(*(asyncio.to_thread(resolver.resolve, c) for c in request.comments))
+        unknown = [comment for comment, candidate in zip(request.comments, candidates) if candidate is None]
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Unknown comments: {', '.join(unknown)}")
+
+        labels = await batcher.classify(candidates)
+        return [ClassificationDto(comment=c, label=label) for c, label in zip(request.comments, labels)]
+
+    def get_stats() -> StatsDto:
+        return batcher.stats
+
+    server = FastAPI(docs_url="/api/swagger", openapi_url="/api/openapi.json", redoc_url=None)
+    server.post("/api/classify", tags=["API"])(classify)
+    server.get("/api/stats", tags=["API"])(get_stats)
+
+    try:
+        print(f"Starting server at http://127.0.0.1:{port} (press CTRL+C to stop).")
+        uvicorn.run(server, port=port, log_level="warning")
+    except KeyboardInterrupt:
+        pass
+    stats = batcher.stats
+    print(f"Served {stats.requestCount} requests, latency p50: {stats.latencyP50Ms:.1f} ms, "
+          f"p99: {stats.latencyP99Ms:.1f} ms, mean batch size: {stats.meanBatchSize:.1f}")
+
+
+def read_args() -> tuple[str, int]:
+    parser = argparse.ArgumentParser("python -m simple.server", description="Serve the classification of comments")
+    parser.add_argument("-m", "--model", default=DEFAULT_MODEL_PATH, metavar="M",
+                        help="Path of the persisted model (fitted on dataset.xlsx and persisted if it doesn't exist)")
+    parser.add_argument("-p", "--port", type=int, default=8001, metavar="P", help="Port of the server")
+    args = parser.parse_args()
+    return args.model, args.port
+
+
+def main() -> None:
+    model_path, port = read_args()
+    model, columns = load_model(model_path)
+
+    api = GerritApi("https://review.opendev.org", "openstack/nova", ApiCache())
+    resolver = CommentResolver(api, load_comment_metas_from_dataset(LABELED_DATASET_PATH))
+    batcher = MicroBatcher(Classifier(FeatureExtractor(api), model, columns))
+    run_server(resolver, batcher, port)
+
+
+if __name__ == "__main__":
+    main()
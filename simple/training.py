@@ -0,0 +1,27 @@
+import joblib
+import pandas as pd
+
+from features.comment_groups import add_comment_group_metrics
+from simple.models import SEED, Simple, reduce_pipeline_cache
+
+META_COLS = ["meta.comment_id", "meta.url", "meta.label", "meta.start_line", "meta.end_line"]
+LABEL_COL = "meta.label"
+DEFAULT_MODEL_PATH = "simple.joblib"
+
+
+def load_dataset() -> tuple[pd.DataFrame, pd.Series]:
+    df = pd.read_excel("dataset.xlsx")
+    df = df.sample(frac=1, random_state=SEED).reset_index(drop=True)
+    add_comment_group_metrics(df)
+    return df.drop(columns=META_COLS), df[LABEL_COL]
+
+
+def train(path: str) -> tuple[Simple, list[str]]:
+    """Fits the model on the dataset and persists it with its input columns."""
+    X, y = load_dataset()
+    model = Simple().fit(X, y)
+    reduce_pipeline_cache()
+    # The cache is of this machine's checkout, so the persisted model must not write to (or fail without) it
+    model._pipeline.set_params(memory=None)
+    joblib.dump((model, list(X.columns)), path)
+    return model, list(X.columns)
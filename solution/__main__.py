@@ -1,67 +1,59 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
 import numpy as np
-import torch
 from sklearn.model_selection import StratifiedKFold
-from sklearn.metrics import matthews_corrcoef, precision_score, accuracy_score, f1_score, recall_score
 
+from data.metrics import METRIC_NAMES
 from solution.args import read_args
-from solution.data import get_data, partition_data
-from solution.model import Model, train, evaluate
-from solution.custom_random_forest import CustomRandomForest
+from solution.final_model import train_final_model
+from solution.folds import get_device, init_fold_process, load_data, run_fold, run_fold_in_process
 from solution.metrics import Metrics
 
-TEST_SIZE = 0.2
-
 if __name__ == "__main__":
-    seed, epochs, batch_size, folds, path = read_args()
+    args = read_args()
 
-    torch.manual_seed(seed)
-    device = torch.device("cuda" if torch.cuda.is_available() else
-                          "mps" if torch.backends.mps.is_available() else "cpu")
+    device = get_device()
 
-    print(f"Starting training with seed {seed}, {epochs} epochs, {batch_size} batch size, {folds} folds")
+    print(f"Starting training with seed {args.seed}, {args.epochs} epochs, {args.batch_size} batch size, "
+          f"{args.folds} folds{', dynamic padding' if args.dynamic_padding else ''}"
+          f"{', frozen encoders' if args.frozen_encoders else ''}{', shared encoder' if args.shared_encoder else ''}"
+          f"{', bfloat16' if args.bf16 else ''}{', gradient checkpointing' if args.gradient_checkpointing else ''}"
+          f"{f', {args.accumulation_steps} accumulation steps' if args.accumulation_steps > 1 else ''}")
     print(f"Using device: {device}")
 
     # Read data
-    X, Y = get_data(path)
-
-    # Prepare metrics
-    metric_calculator = {"accuracy": lambda true, predicted: accuracy_score(true, predicted),
-                         "mcc": lambda true, predicted: matthews_corrcoef(true, predicted),
-                         "precision_macro": lambda true, predicted: precision_score(true, predicted, average='macro'),
-                         "precision_micro": lambda true, predicted: precision_score(true, predicted, average='micro'),
-                         "precision_weighted": lambda true, predicted: precision_score(true, predicted, average='weighted'),
-                         "f1_macro": lambda true, predicted: f1_score(true, predicted, average='macro'),
-                         "f1_micro": lambda true, predicted: f1_score(true, predicted, average='micro'),
-                         "f1_weighted": lambda true, predicted: f1_score(true, predicted, average='weighted'),
-                         "recall_macro": lambda true, predicted: recall_score(true, predicted, average='macro'),
-                         "recall_micro": lambda true, predicted: recall_score(true, predicted, average='micro'),
-                         "recall_weighted": lambda true, predicted: recall_score(true, predicted, average='weighted')}
-    metrics = Metrics(metric_calculator.keys())
-
-    kf = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
-    for fold, (train_idx, val_idx) in enumerate(kf.split(Y, Y.argmax(axis=1))):
-        print(f"Fold {fold + 1}")
-
-        # Divide the training set into training and validation sets
-        X_train, Y_train = partition_data(X, train_idx), Y[train_idx,]
-        X_val, Y_val = partition_data(X, val_idx), Y[val_idx,]
-
-        # Evaluate random forest
-        forest = CustomRandomForest(random_state=seed)
-        forest.fit(X_train["metrics"], Y_train.argmax(axis=1).astype(str))
-        X_train["metrics"] = forest.predict_proba(X_train["metrics"]).astype(np.float32)
-        X_val["metrics"] = forest.predict_proba(X_val["metrics"]).astype(np.float32)
-
-        # Prepare model
-        model = Model(X_train["metrics"].shape[1]).to(device)
-        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5, eps=1e-7)
-
-        # Train the model
-        train(model, device, optimizer, epochs, batch_size, X_train, Y_train, X_val, Y_val)
-
-        # Evaluate the model
-        results = evaluate(model, device, X_val, Y_val, metric_calculator)
-        metrics.append(**results)
-
-    metrics.print_all_values()
-    metrics.print()
+    X, Y, info = load_data(args.path, device, args.frozen_encoders, args.float16)
+
+    if args.final_model:
+        train_final_model(X, Y, info, args)
+    else:
+        metrics = Metrics(METRIC_NAMES)
+
+        kf = StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=args.seed)
+        splits = list(kf.split(Y, Y.argmax(axis=1)))
+        if args.parallel_folds > 1 and args.workers is None:
+            args.workers = 0  # the fold processes already keep the cores busy
+        trained_epochs = []
+        if args.parallel_folds == 1:
+            for fold, (train_idx, val_idx) in enumerate(splits):
+                results = run_fold(X, Y, fold, train_idx, val_idx, args)
+                metrics.append(**results)
+                trained_epochs.append(results["epochs"])
+        else:
+            # The cores are split between the fold processes, which would otherwise each use all of them
+            threads = max(1, (os.cpu_count() or 1) // args.parallel_folds)
+            print(f"Running {args.parallel_folds} folds at a time, with {threads} threads each")
+            with ProcessPoolExecutor(args.parallel_folds, get_context("spawn"), init_fold_process,
+                                     (threads, args.path, args.frozen_encoders, args.float16)) as executor:
+                futures = [executor.submit(run_fold_in_process, fold, train_idx, val_idx, args)
+                           for fold, (train_idx, val_idx) in enumerate(splits)]
+                for future in futures:
+                    metrics.append(**future.result())
+                    trained_epochs.append(future.result()["epochs"])
+
+        print(f"Trained {sum(trained_epochs)} epochs in total, "
+              f"{args.folds * args.epochs - sum(trained_epochs)} of {args.folds * args.epochs} saved by stopping early")
+        metrics.print_all_values()
+        metrics.print(np.random.default_rng(args.seed))
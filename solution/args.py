@@ -3,6 +3,7 @@ import argparse
 DEFAULT_SEED = 0
 DEFAULT_EPOCHS = 40
 DEFAULT_BATCH_SIZE = 4
+DEFAULT_EVAL_BATCH_SIZE = 32
 DEFAULT_FOLDS = 10
 DEFAULT_PATH = "dataset.xlsx"
 
@@ -15,6 +16,7 @@ def positive_int(value):
 
 
 def read_args():
+    """Parses the training options, which are passed on as the returned namespace."""
     parser = argparse.ArgumentParser("python -m solution", description="Train a model on the dataset")
     parser.add_argument("-s", "--seed", type=int, default=DEFAULT_SEED, metavar="S",
                         help="Seed for random number generators")
@@ -22,10 +24,45 @@ def read_args():
                         help="Number of epochs to train the model")
     parser.add_argument("-b", "--batch_size", type=positive_int, default=DEFAULT_BATCH_SIZE, metavar="B",
                         help="Batch size for training")
+    parser.add_argument("--eval_batch_size", type=positive_int, default=DEFAULT_EVAL_BATCH_SIZE, metavar="B",
+                        help="Batch size for validation and evaluation")
     parser.add_argument("-f", "--folds", type=positive_int, default=DEFAULT_FOLDS, metavar="F",
                         help="Number of folds for cross-validation")
+    parser.add_argument("-j", "--parallel_folds", type=positive_int, default=1, metavar="J",
+                        help="Number of folds trained at the same time, in separate processes")
+    parser.add_argument("-w", "--workers", type=int, default=None, metavar="W",
+                        help="Number of background processes preparing the batches (0 to prepare them in place, "
+                             "default: up to 2 spare cores)")
     parser.add_argument("-p", "--path", type=argparse.FileType(), default=DEFAULT_PATH, metavar="P",
                         help="Path to the dataset")
+    parser.add_argument("-d", "--dynamic_padding", action="store_true",
+                        help="Batch samples of similar length and pad each batch only to its longest sequence")
+    parser.add_argument("--frozen_encoders", action="store_true",
+                        help="Do not fine-tune the encoders; their outputs are computed once and cached on disk "
+                             "(implies dynamic padding)")
+    parser.add_argument("--shared_encoder", action="store_true",
+                        help="Encode both the comments and the code with a single encoder")
+    parser.add_argument("--checkpoints", metavar="DIR",
+                        help="Save the training state of every fold to DIR after each epoch, and resume from it "
+                             "(use a separate DIR for every configuration)")
+    parser.add_argument("--patience", type=positive_int, default=None, metavar="N",
+                        help="Stop training a fold once its validation loss hasn't improved for N epochs")
+    parser.add_argument("--bf16", action="store_true",
+                        help="Train in bfloat16 autocast, which saves activation memory")
+    parser.add_argument("--gradient_checkpointing", action="store_true",
+                        help="Recompute the encoder activations in the backward pass instead of keeping them")
+    parser.add_argument("--accumulation_steps", type=positive_int, default=1, metavar="K",
+                        help="Accumulate the gradients of K batches into every optimizer step "
+                             "(an effective batch size of K * B)")
+    parser.add_argument("--final_model", metavar="DIR",
+                        help="Instead of cross-validation, train the final model on the whole dataset except for "
+                             "a test split and save it (with a quantized version for CPU inference) to DIR")
+    parser.add_argument("--float16", action="store_true",
+                        help="Store the cached encoder outputs as float16 to halve their size")
 
     args = parser.parse_args()
-    return args.seed, args.epochs, args.batch_size, args.folds, args.path.name
+    if args.final_model and args.frozen_encoders:
+        parser.error("the final model cannot be trained with --frozen_encoders, since it has to include the encoders")
+    args.path = args.path.name
+    args.dynamic_padding = args.dynamic_padding or args.frozen_encoders
+    return args
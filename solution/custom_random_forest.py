@@ -1,18 +1,27 @@
+from hashlib import sha3_256
+from pathlib import Path
 
+import joblib
+import numpy as np
 from sklearn.base import BaseEstimator
 from sklearn.discriminant_analysis import StandardScaler
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.feature_selection import SelectKBest, VarianceThreshold
+from sklearn.model_selection import StratifiedKFold
 from sklearn.pipeline import make_pipeline
 
+STACKING_FOLDS = 5
+
+_CACHE_DIR = Path(__file__).parent.resolve() / "__forestcache__"
+
 
 class CustomRandomForest(BaseEstimator):
-    def __init__(self, random_state: int = None) -> None:
+    def __init__(self, random_state: int = None, n_jobs: int = None) -> None:
         self._pipeline = make_pipeline(
             VarianceThreshold(),
             StandardScaler(),
             SelectKBest(k=50),
-            RandomForestClassifier(n_estimators=250, random_state=random_state),
+            RandomForestClassifier(n_estimators=250, random_state=random_state, n_jobs=n_jobs),
         )
 
     def fit(self, X, y):
@@ -21,3 +30,61 @@ class CustomRandomForest(BaseEstimator):
 
     def predict_proba(self, X):
         return self._pipeline.predict_proba(X)
+
+
+def fit_forest_stage(metrics, labels, train_idx, val_idx, seed, n_jobs=None):
+    """
+    Fits the forest on the training samples and returns it with the class probabilities of the training
+    and validation samples. The probabilities of the training samples are out-of-fold, predicted by forests
+    that did not see them, so that the model is trained on the same kind of inputs it is evaluated on.
+    The results are cached on disk, since they do not depend on the model's hyperparameters.
+    """
+    key = _cache_key(metrics, labels, train_idx, val_idx, seed)
+    if (cached := _load_cached(key)) is not None:
+        return cached
+
+    classes, counts = np.unique(labels[train_idx], return_counts=True)
+    train_probabilities = np.zeros((len(train_idx), len(classes)), dtype=np.float32)
+    # Small training sets are split into fewer folds, as every fold needs a sample of the most common class
+    splits = max(2, min(STACKING_FOLDS, counts.max()))
+    inner_folds = StratifiedKFold(n_splits=splits, shuffle=True, random_state=seed)
+    for inner_train, inner_val in inner_folds.split(train_idx, labels[train_idx]):
+        forest = CustomRandomForest(random_state=seed, n_jobs=n_jobs)
+        forest.fit(metrics[train_idx[inner_train]], labels[train_idx[inner_train]])
+        # A rare class may be missing from the inner training samples
+        columns = np.searchsorted(classes, forest._pipeline.classes_)
+        train_probabilities[np.ix_(inner_val, columns)] = forest.predict_proba(metrics[train_idx[inner_val]])
+
+    forest = CustomRandomForest(random_state=seed, n_jobs=n_jobs).fit(metrics[train_idx], labels[train_idx])
+    val_probabilities = forest.predict_proba(metrics[val_idx]).astype(np.float32)
+
+    result = forest, train_probabilities, val_probabilities
+    _store_cached(key, result)
+    return result
+
+
+def _cache_key(metrics, labels, train_idx, val_idx, seed):
+    # The repr of the pipeline holds all parameters that differ from the defaults
+    digest = sha3_256(f"{STACKING_FOLDS}|{CustomRandomForest(random_state=seed)._pipeline!r}".encode())
+    for array in [metrics, labels, train_idx, val_idx]:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def _load_cached(key):
+    try:
+        return joblib.load(_CACHE_DIR / f"{key}.joblib")
+    except:
+        return None
+
+
+def _store_cached(key, result):
+    try:
+        _CACHE_DIR.mkdir(exist_ok=True)
+        tmp_path = _CACHE_DIR / f"{key}.tmp.joblib"
+        joblib.dump(result, tmp_path)
+        tmp_path.replace(_CACHE_DIR / f"{key}.joblib")
+    except:
+        pass  # the cache's only purpose is to speed up performance, so we can ignore any errors
@@ -1,3 +1,8 @@
+from functools import lru_cache
+from hashlib import sha3_256
+from itertools import chain
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 from transformers import RobertaTokenizerFast
@@ -10,43 +15,182 @@ Y_COLUMN = "meta.label"
 COMMENT_COLUMN = "comment.text"
 CODE_COLUMN = "code.range.text"
 
-tokenizer = RobertaTokenizerFast.from_pretrained('microsoft/codebert-base')
+TOKENIZER_NAME = "microsoft/codebert-base"
+MAX_LENGTH = 512
+TOKENIZE_BATCH_SIZE = 256
+BUCKET_BATCHES = 16  # number of batches which are sorted by length together in the dynamic padding mode
+
+_CACHE_DIR = Path(__file__).parent.resolve() / "__tokencache__"
+
+
+@lru_cache
+def get_tokenizer():
+    return RobertaTokenizerFast.from_pretrained(TOKENIZER_NAME)
+
+
+class RaggedArray:
+    """
+    Unpadded sequences (of tokens or their embeddings), stored as a single array of concatenated sequence items
+    and the start and end positions of every sequence in it. Selecting sequences does not copy the items, so that
+    the (memory-mapped) items are only read when the sequences are padded.
+    """
+
+    def __init__(self, values, starts, ends, pad_value=0):
+        self.values = values
+        self.starts = starts
+        self.ends = ends
+        self.pad_value = pad_value
+
+    @staticmethod
+    def from_offsets(values, offsets, pad_value=0):
+        offsets = np.asarray(offsets)
+        return RaggedArray(values, offsets[:-1], offsets[1:], pad_value)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        return RaggedArray(self.values, self.starts[idx], self.ends[idx], self.pad_value)
+
+    @property
+    def lengths(self):
+        return self.ends - self.starts
+
+    def flatten(self):
+        """Returns the items of the sequences as a contiguous array, along with the offsets of the sequences."""
+        lengths = self.lengths
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        positions = np.repeat(self.starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return self.values[positions], offsets
+
+    @property
+    def is_embedded(self):
+        return self.values.ndim > 1
+
+    def pad(self, length=None):
+        lengths = self.lengths
+        if length is None:
+            length = int(lengths.max(initial=1))
+        lengths = np.minimum(lengths, length)
+        dtype = np.float32 if self.is_embedded else np.int32
+        padded = np.full((len(self), length, *self.values.shape[1:]), self.pad_value, dtype=dtype)
+        attention_masks = np.zeros((len(self), length), dtype=np.int32)
+        rows = np.repeat(np.arange(len(self)), lengths)
+        cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        padded[rows, cols] = self.values[np.repeat(self.starts, lengths) + cols]
+        attention_masks[rows, cols] = 1
+        return padded, attention_masks
 
 
 def get_data(path):
+    """
+    Reads the labeled dataset. Besides the model inputs and one-hot labels, returns the names of the labels
+    and of the metric columns, which are needed to apply a trained model to new data.
+    """
     df = pd.read_excel(path)
-    df = add_comment_group_metrics(df)
+    labels = pd.get_dummies(df[Y_COLUMN])
+    Y = np.array(labels.values.tolist())
 
-    Y = np.array(pd.get_dummies(df[Y_COLUMN]).values.tolist())
+    X, metric_columns = get_inputs(df)
+    return X, Y, {"labels": list(labels.columns), "metric_columns": metric_columns}
 
-    code = df[CODE_COLUMN]
-    comment = df[COMMENT_COLUMN]
 
-    code_input_ids, code_attention_masks = tokenize_dataframe(code)
-    comment_input_ids, comment_attention_masks = tokenize_dataframe(comment)
+def get_inputs(df, metric_columns=None):
+    df = add_comment_group_metrics(df)
+    metrics = df.drop(columns=[*COLUMNS_TO_DROP, COMMENT_COLUMN, CODE_COLUMN, Y_COLUMN], errors="ignore")
+    if metric_columns is not None:
+        metrics = metrics[metric_columns]
 
     X = {
-        "comment_input_ids": comment_input_ids,
-        "comment_attention_masks": comment_attention_masks,
-        "code_input_ids": code_input_ids,
-        "code_attention_masks": code_attention_masks,
-        "metrics": df.drop(columns=[*COLUMNS_TO_DROP, COMMENT_COLUMN, CODE_COLUMN, Y_COLUMN]).to_numpy(dtype=np.float32)
+        "comment": tokenize_dataframe(df[COMMENT_COLUMN]),
+        "code": tokenize_dataframe(df[CODE_COLUMN]),
+        "metrics": metrics.to_numpy(dtype=np.float32)
     }
 
-    return X, Y
+    return X, list(metrics.columns)
 
 
-def tokenize_dataframe(df):
-    input_ids = []
-    attention_masks = []
+def tokenize_dataframe(df, tokenizer=None, use_cache=True):
+    tokenizer = tokenizer or get_tokenizer()
+    sentences = [str(sentence) for sentence in df]
 
-    for sentence in df:
-        # NOTE: When tokenizing sentences that are too long, they will be truncated. This is not ideal.
-        tokens = tokenizer(str(sentence), truncation=True, padding="max_length")
-        input_ids.append(tokens["input_ids"])
-        attention_masks.append(tokens["attention_mask"])
+    # The arrays are stored on disk, keyed by the sentences and tokenizer config, and are memory-mapped on reuse
+    key = _cache_key(sentences, tokenizer)
+    if use_cache and (cached := _load_cached(key)):
+        return RaggedArray.from_offsets(*cached, tokenizer.pad_token_id)
 
-    return np.array(input_ids, dtype=np.int32), np.array(attention_masks, dtype=np.int32)
+    input_ids = []
+    for start in range(0, len(sentences), TOKENIZE_BATCH_SIZE):
+        # NOTE: When tokenizing sentences that are too long, they will be truncated. This is not ideal.
+        tokens = tokenizer(sentences[start:start + TOKENIZE_BATCH_SIZE], truncation=True, max_length=MAX_LENGTH)
+        input_ids += tokens["input_ids"]
+
+    values = np.fromiter(chain.from_iterable(input_ids), dtype=np.int32)
+    offsets = np.concatenate(([0], np.cumsum([len(ids) for ids in input_ids]))).astype(np.int64)
+    if use_cache:
+        _store_cached(key, values, offsets)
+    return RaggedArray.from_offsets(values, offsets, tokenizer.pad_token_id)
+
+
+def to_model_inputs(data, pad_to=None):
+    """
+    Pads the sequences to the given length (or to the longest sequence) and names them as `Model` inputs,
+    i.e. token ids or, if the encoders were applied beforehand, their hidden states.
+    """
+    inputs = {"metrics": data["metrics"]}
+    for name in ["comment", "code"]:
+        values_name = "hidden_states" if data[name].is_embedded else "input_ids"
+        inputs[f"{name}_{values_name}"], inputs[f"{name}_attention_masks"] = data[name].pad(pad_to)
+    return inputs
+
+
+def make_batches(data, batch_size, dynamic_padding=False, rng=None):
+    """
+    Splits the sample indices into batches, which are shuffled by `rng` (or taken in order if it is not given).
+    With dynamic padding, samples of similar length are batched together, in buckets of `BUCKET_BATCHES` batches,
+    so that padding each batch to its longest sequence wastes little computation.
+    """
+    size = len(data["metrics"])
+    order = rng.permutation(size) if rng is not None else np.arange(size)
+    if not dynamic_padding:
+        return [order[i:i + batch_size] for i in range(0, size, batch_size)]
+
+    lengths = data["comment"].lengths + data["code"].lengths
+    bucket_size = batch_size * BUCKET_BATCHES
+    batches = []
+    for i in range(0, size, bucket_size):
+        bucket = order[i:i + bucket_size]
+        bucket = bucket[np.argsort(lengths[bucket], kind="stable")]
+        batches += [bucket[j:j + batch_size] for j in range(0, len(bucket), batch_size)]
+    if rng is not None:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+
+def _cache_key(sentences, tokenizer):
+    digest = sha3_256(f"{type(tokenizer).__name__}|{tokenizer.name_or_path}|{len(tokenizer)}|{MAX_LENGTH}".encode())
+    for sentence in sentences:
+        digest.update(b"\0" + sentence.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _load_cached(key):
+    try:
+        return (np.load(_CACHE_DIR / f"{key}.values.npy", mmap_mode="r"),
+                np.load(_CACHE_DIR / f"{key}.offsets.npy", mmap_mode="r"))
+    except:
+        return None
+
+
+def _store_cached(key, values, offsets):
+    try:
+        _CACHE_DIR.mkdir(exist_ok=True)
+        for name, array in [("values", values), ("offsets", offsets)]:
+            tmp_path = _CACHE_DIR / f"{key}.{name}.tmp.npy"
+            np.save(tmp_path, array)
+            tmp_path.replace(_CACHE_DIR / f"{key}.{name}.npy")
+    except:
+        pass  # the cache's only purpose is to speed up performance, so we can ignore any errors
 
 
 def partition_data(data, idx):
@@ -0,0 +1,90 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+
+from data.metrics import confusion_matrix, scores
+from solution.args import DEFAULT_EVAL_BATCH_SIZE, positive_int
+from solution.data import Y_COLUMN, get_inputs, partition_data
+from solution.final_model import REPORT_METRICS, load_final_model
+from solution.custom_random_forest import fit_forest_stage
+from solution.folds import get_device
+from solution.model import predict
+from solution.student import STUDENT_FILE, Student, predict_student, save_student, train_student
+
+DEFAULT_EPOCHS = 30
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_PATH = "dataset.xlsx"
+
+
+def read_args():
+    parser = argparse.ArgumentParser("python -m solution.distill",
+                                     description="Distill a model saved by python -m solution --final_model "
+                                                 "into a compact student model")
+    parser.add_argument("-m", "--model", required=True, metavar="DIR",
+                        help="Directory of the saved (teacher) model, where the student is saved as well")
+    parser.add_argument("-e", "--epochs", type=positive_int, default=DEFAULT_EPOCHS, metavar="E",
+                        help="Number of epochs to train the student")
+    parser.add_argument("-b", "--batch_size", type=positive_int, default=DEFAULT_BATCH_SIZE, metavar="B",
+                        help="Batch size for training the student")
+    parser.add_argument("-p", "--path", type=argparse.FileType(), default=DEFAULT_PATH, metavar="P",
+                        help="Path to the dataset")
+
+    args = parser.parse_args()
+    return args.model, args.epochs, args.batch_size, args.path.name
+
+
+def report(name, probabilities, true_class, teacher_class, duration):
+    predicted_class = probabilities.argmax(axis=1)
+    results = scores(confusion_matrix(true_class, predicted_class, probabilities.shape[1]))
+    results = ", ".join(f"{metric}: {results[metric]:.4f}" for metric in REPORT_METRICS)
+    print(f"  {name}: {results}, agreement with the teacher: {np.mean(predicted_class == teacher_class):.4f}, "
+          f"{len(true_class) / duration:.1f} samples/s")
+
+
+if __name__ == "__main__":
+    model_path, epochs, batch_size, path = read_args()
+    device = get_device()
+
+    _, teacher, config = load_final_model(model_path, quantized=False)
+    seed = config["seed"]
+    torch.manual_seed(seed)
+    df = pd.read_excel(path)
+    X, _ = get_inputs(df, config["metric_columns"])
+    true_class = df[Y_COLUMN].map({label: i for i, label in enumerate(config["labels"])}).to_numpy()
+
+    # The teacher's test split is held out, so that the student is compared with the teacher on unseen samples
+    train_idx, test_idx = np.array(config["train_indices"]), np.array(config["test_indices"])
+    if len(train_idx) + len(test_idx) != len(true_class):
+        raise ValueError(f"The model was trained on {len(train_idx) + len(test_idx)} samples, "
+                         f"but {path} has {len(true_class)}")
+    X_train, X_test = partition_data(X, train_idx), partition_data(X, test_idx)
+    # The teacher was trained on the out-of-fold forest probabilities, which are usually still cached
+    _, X_train["metrics"], X_test["metrics"] = fit_forest_stage(X["metrics"], true_class, train_idx, test_idx, seed,
+                                                                torch.get_num_threads())
+
+    print("Computing the teacher's outputs...")
+    teacher_probabilities = predict(teacher.to(device), device, X_train, DEFAULT_EVAL_BATCH_SIZE,
+                                    config["pack_sequences"]).cpu().numpy()
+
+    student = Student(X_train["metrics"].shape[1])
+    train_student(student, X_train, teacher_probabilities, epochs, batch_size, np.random.default_rng(seed))
+    save_student(student, model_path)
+    print(f"Saved the student to {Path(model_path) / STUDENT_FILE}")
+
+    # Both models are compared on the CPU
+    cpu = torch.device("cpu")
+    start = time.perf_counter()
+    teacher_output = predict(teacher.to(cpu), cpu, X_test, DEFAULT_EVAL_BATCH_SIZE, config["pack_sequences"], 0)
+    teacher_duration = time.perf_counter() - start
+    start = time.perf_counter()
+    student_output = predict_student(student, X_test)
+    student_duration = time.perf_counter() - start
+
+    teacher_class = teacher_output.argmax(1).numpy()
+    print(f"CPU inference on {len(test_idx)} test samples:")
+    report("teacher", teacher_output.numpy(), true_class[test_idx], teacher_class, teacher_duration)
+    report("student", student_output.numpy(), true_class[test_idx], teacher_class, student_duration)
@@ -0,0 +1,70 @@
+from hashlib import sha3_256
+from pathlib import Path
+
+import numpy as np
+import torch
+from transformers import RobertaModel
+from tqdm import tqdm
+
+from solution.data import RaggedArray
+from solution.model import ENCODER_NAME
+
+EMBEDDING_BATCH_SIZE = 32
+
+_CACHE_DIR = Path(__file__).parent.resolve() / "__embeddingcache__"
+
+
+def embed_data(data, device, dtype=np.float32):
+    """
+    Replaces the token sequences of the data with the hidden states of the pretrained (frozen) encoder.
+    Both inputs are embedded by the same encoder, since both encoders of `Model` start from the same weights.
+    """
+    encoder = None
+    embedded = dict(data)
+    for name in ["comment", "code"]:
+        key = _cache_key(data[name], dtype)
+        if (cached := _load_cached(key)) is None:
+            if encoder is None:
+                encoder = RobertaModel.from_pretrained(ENCODER_NAME).to(device)
+            _store_cached(key, data[name], encoder, device, dtype)
+            cached = _load_cached(key)
+        embedded[name] = RaggedArray(cached, data[name].starts, data[name].ends)
+    return embedded
+
+
+def _store_cached(key, tokens, encoder, device, dtype):
+    _CACHE_DIR.mkdir(exist_ok=True)
+    tmp_path = _CACHE_DIR / f"{key}.tmp.npy"
+    values = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype,
+                                       shape=(len(tokens.values), encoder.config.hidden_size))
+
+    # The sequences are embedded in the order of their length, so that hardly any computation is wasted on padding
+    order = np.argsort(tokens.lengths, kind="stable")
+    encoder.eval()
+    with torch.no_grad():
+        for i in tqdm(range(0, len(order), EMBEDDING_BATCH_SIZE), desc="Embedding"):
+            idx = order[i:i + EMBEDDING_BATCH_SIZE]
+            input_ids, attention_masks = tokens[idx].pad()
+            hidden_states = encoder(input_ids=torch.tensor(input_ids).to(device),
+                                    attention_mask=torch.tensor(attention_masks).to(device))[0].cpu().numpy()
+            for row, (start, end) in enumerate(zip(tokens.starts[idx], tokens.ends[idx])):
+                values[start:end] = hidden_states[row, :end - start]
+
+    values.flush()
+    del values
+    tmp_path.replace(_CACHE_DIR / f"{key}.npy")
+
+
+def _load_cached(key):
+    try:
+        return np.load(_CACHE_DIR / f"{key}.npy", mmap_mode="r")
+    except:
+        return None
+
+
+def _cache_key(tokens, dtype):
+    digest = sha3_256(f"{ENCODER_NAME}|{np.dtype(dtype).name}".encode())
+    digest.update(np.ascontiguousarray(tokens.values).tobytes())
+    digest.update(np.ascontiguousarray(tokens.starts).tobytes())
+    digest.update(np.ascontiguousarray(tokens.ends).tobytes())
+    return digest.hexdigest()
@@ -0,0 +1,130 @@
+import copy
+import json
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import torch
+from torch import nn
+from sklearn.model_selection import train_test_split
+
+from data.metrics import confusion_matrix, scores
+from solution.data import MAX_LENGTH, partition_data, to_model_inputs
+from solution.folds import fit_fold
+from solution.model import Model, predict
+
+TEST_SIZE = 0.2
+FOREST_FILE = "forest.joblib"
+MODEL_FILE = "model.pt"
+QUANTIZED_MODEL_FILE = "model.int8.pt"  # TorchScript
+CONFIG_FILE = "config.json"
+
+REPORT_METRICS = ["accuracy", "mcc", "f1_macro"]
+LATENCY_SAMPLES = 50
+TRACE_SAMPLES = 2  # the traced model is checked on the other example inputs, i.e. another batch size and length
+
+
+def train_final_model(X, Y, info, args):
+    """
+    Trains the random forest and the model on the dataset except for a stratified test split, with the options of
+    `solution.args.read_args`, and saves them in the `args.final_model` directory, together with a quantized
+    TorchScript version of the model for CPU inference. The latency and accuracy of both model versions are reported
+    on the test split.
+    """
+    train_idx, test_idx = train_test_split(np.arange(len(Y)), test_size=TEST_SIZE, stratify=Y.argmax(axis=1),
+                                           random_state=args.seed)
+    checkpoint_path = Path(args.checkpoints) / "final.pt" if args.checkpoints is not None else None
+    forest, model, X_test, Y_test, _ = fit_fold(X, Y, 0, train_idx, test_idx, args, checkpoint_path)
+
+    directory = Path(args.final_model)
+    directory.mkdir(parents=True, exist_ok=True)
+    # The split is saved, so that the test samples stay held out of anything fitted on the model (see solution.distill)
+    config = {**info, "pack_sequences": args.dynamic_padding, "shared_encoder": args.shared_encoder, "seed": args.seed,
+              "train_indices": train_idx.tolist(), "test_indices": test_idx.tolist()}
+    (directory / CONFIG_FILE).write_text(json.dumps(config, indent=2))
+    joblib.dump(forest, directory / FOREST_FILE)
+    model = model.cpu().eval()
+    torch.save(model.state_dict(), directory / MODEL_FILE)
+
+    quantized = export_quantized(model, partition_data(X_test, np.arange(min(len(Y_test), TRACE_SAMPLES + 1))),
+                                 config, directory / QUANTIZED_MODEL_FILE)
+    print(f"Saved the final model to {directory}")
+
+    report_inference(model, quantized, X_test, Y_test, config, args.eval_batch_size)
+
+
+def export_quantized(model, example_X, config, path):
+    """
+    Applies dynamic int8 quantization to the linear layers of the encoders, which hold nearly all of the weights,
+    and saves the model as TorchScript, traced on the first `TRACE_SAMPLES` example inputs. The traced model is
+    checked against the quantized one on all example inputs, as tracing freezes any sizes the model computes
+    in Python, which would break (or silently change) the model for other batch sizes and sequence lengths.
+    """
+    quantized = copy.deepcopy(model).cpu().eval()
+    for name in ["codebert_comment", "codebert_code"]:
+        if (encoder := getattr(quantized, name)) is not None:
+            setattr(quantized, name, torch.ao.quantization.quantize_dynamic(encoder, {nn.Linear}, dtype=torch.qint8))
+
+    size = len(example_X["metrics"])
+    trace_idx = np.arange(min(size, TRACE_SAMPLES))
+    check_idx = np.arange(size) if size != len(trace_idx) else np.arange(1)
+    trace_inputs, check_inputs = [{key: torch.from_numpy(value)
+                                   for key, value in to_model_inputs(partition_data(example_X, idx),
+                                                                     _pad_to(config)).items()}
+                                  for idx in [trace_idx, check_idx]]
+    with torch.no_grad():
+        scripted = torch.jit.trace(quantized, example_kwarg_inputs=trace_inputs, strict=False)
+        expected, actual = quantized(**check_inputs), scripted(**check_inputs)
+    if expected.shape != actual.shape or not torch.allclose(expected, actual, atol=1e-5):
+        raise RuntimeError(f"The traced model differs from the quantized one on {len(check_idx)} samples, "
+                           f"after being traced on {len(trace_idx)}")
+    scripted.save(str(path))
+    return scripted
+
+
+def load_final_model(directory, quantized=True, model=True):
+    directory = Path(directory)
+    config = json.loads((directory / CONFIG_FILE).read_text())
+    forest = joblib.load(directory / FOREST_FILE)
+    if not model:
+        return forest, None, config
+    if quantized:
+        model = torch.jit.load(str(directory / QUANTIZED_MODEL_FILE), map_location="cpu")
+    else:
+        model = Model(len(config["labels"]), config["pack_sequences"], shared_encoder=config["shared_encoder"])
+        model.load_state_dict(torch.load(directory / MODEL_FILE, map_location="cpu"))
+    return forest, model.eval(), config
+
+
+def report_inference(model, quantized, X_test, Y_test, config, eval_batch_size):
+    device = torch.device("cpu")
+    true_class = Y_test.argmax(axis=1)
+    print(f"CPU inference on {len(true_class)} test samples:")
+    for name, m in [("float", model), ("int8 TorchScript", quantized)]:
+        start = time.perf_counter()
+        predicted_class = predict(m, device, X_test, eval_batch_size, config["pack_sequences"], 0).argmax(1).numpy()
+        throughput = len(true_class) / (time.perf_counter() - start)
+
+        latencies = _single_sample_latencies(m, X_test, config)
+        results = scores(confusion_matrix(true_class, predicted_class, Y_test.shape[1]))
+        results = ", ".join(f"{metric}: {results[metric]:.4f}" for metric in REPORT_METRICS)
+        print(f"  {name}: {results}, {throughput:.1f} samples/s in batches of {eval_batch_size}, "
+              f"single sample latency p50: {np.percentile(latencies, 50):.1f} ms, "
+              f"p99: {np.percentile(latencies, 99):.1f} ms")
+
+
+def _single_sample_latencies(model, X, config):
+    latencies = []
+    with torch.no_grad():
+        for i in range(min(len(X["metrics"]), LATENCY_SAMPLES)):
+            inputs = {key: torch.from_numpy(value)
+                      for key, value in to_model_inputs(partition_data(X, [i]), _pad_to(config)).items()}
+            start = time.perf_counter()
+            model(**inputs)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def _pad_to(config):
+    return None if config["pack_sequences"] else MAX_LENGTH
@@ -0,0 +1,80 @@
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from solution.data import get_data, partition_data
+from solution.embeddings import embed_data
+from solution.model import Model, train, evaluate, model_size_report
+from solution.custom_random_forest import fit_forest_stage
+
+_process_data = None  # the data of a fold process, loaded once by `init_fold_process`
+
+
+def get_device():
+    return torch.device("cuda" if torch.cuda.is_available() else
+                        "mps" if torch.backends.mps.is_available() else "cpu")
+
+
+def load_data(path, device, frozen_encoders, float16):
+    X, Y, info = get_data(path)
+    if frozen_encoders:
+        # The encoders are not trained, so their outputs are computed once for all folds and epochs
+        X = embed_data(X, device, np.float16 if float16 else np.float32)
+    return X, Y, info
+
+
+def init_fold_process(threads, path, frozen_encoders, float16):
+    global _process_data
+    torch.set_num_threads(threads)
+    # The tokens (and embeddings) are read from the caches filled by the main process
+    _process_data = load_data(path, get_device(), frozen_encoders, float16)
+
+
+def run_fold_in_process(*args, **kwargs):
+    X, Y, _ = _process_data
+    return run_fold(X, Y, *args, **kwargs)
+
+
+def run_fold(X, Y, fold, train_idx, val_idx, args):
+    """Trains and evaluates the model on a fold, with the options of `solution.args.read_args`."""
+    print(f"Fold {fold + 1}")
+    checkpoint_path = Path(args.checkpoints) / f"fold{fold + 1}.pt" if args.checkpoints is not None else None
+    _, model, X_val, Y_val, trained_epochs = fit_fold(X, Y, fold, train_idx, val_idx, args, checkpoint_path)
+
+    # Evaluate the model
+    results = evaluate(model, get_device(), X_val, Y_val, args.dynamic_padding, args.eval_batch_size, args.workers)
+    return {**results, "epochs": trained_epochs}
+
+
+def fit_fold(X, Y, fold, train_idx, val_idx, args, checkpoint_path=None):
+    """
+    Trains the random forest and the model on a fold, with the options of `solution.args.read_args`, returning them
+    with the fold's validation set and the number of epochs the model was trained for.
+    """
+    device = get_device()
+
+    # Every fold is seeded on its own, so that its results do not depend on the other folds or where it runs
+    torch.manual_seed(int(np.random.SeedSequence([args.seed, fold]).generate_state(1)[0]))
+
+    # Divide the training set into training and validation sets
+    X_train, Y_train = partition_data(X, train_idx), Y[train_idx,]
+    X_val, Y_val = partition_data(X, val_idx), Y[val_idx,]
+
+    # The random forest's class probabilities replace the metrics; it uses the threads of this process
+    forest, X_train["metrics"], X_val["metrics"] = fit_forest_stage(X["metrics"], Y.argmax(axis=1), train_idx, val_idx,
+                                                                    args.seed, torch.get_num_threads())
+
+    # Prepare model
+    model = Model(X_train["metrics"].shape[1], pack_sequences=args.dynamic_padding,
+                  encoders=not args.frozen_encoders, shared_encoder=args.shared_encoder,
+                  gradient_checkpointing=args.gradient_checkpointing).to(device)
+    print(f"Model size: {model_size_report(model)}")
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5, eps=1e-7)
+
+    # Train the model
+    trained_epochs = train(model, device, optimizer, args.epochs, args.batch_size, X_train, Y_train, X_val, Y_val,
+                           args.dynamic_padding, np.random.default_rng([args.seed, fold]), args.eval_batch_size,
+                           args.workers, checkpoint_path, args.patience, args.bf16, args.accumulation_steps)
+
+    return forest, model, X_val, Y_val, trained_epochs
@@ -0,0 +1,57 @@
+import os
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from solution.data import make_batches, partition_data, to_model_inputs
+
+# The workers should not take the cores away from the computation on the CPU
+DEFAULT_WORKERS = min(2, (os.cpu_count() or 1) - 1)
+
+
+class BatchDataset(Dataset):
+    """
+    The model inputs of whole batches, indexed by arrays of sample indices.
+    The samples are gathered and padded in a single vectorized step, straight from the (memory-mapped) arrays.
+    """
+
+    def __init__(self, data, pad_to=None):
+        self.data = data
+        self.pad_to = pad_to
+
+    def __len__(self):
+        return len(self.data["metrics"])
+
+    def __getitem__(self, idx):
+        inputs = to_model_inputs(partition_data(self.data, idx), self.pad_to)
+        return torch.from_numpy(idx), {key: torch.from_numpy(value) for key, value in inputs.items()}
+
+
+class EpochBatches:
+    """The batches of sample indices, drawn anew (and thus reshuffled by `rng`) every time they are iterated."""
+
+    def __init__(self, data, batch_size, dynamic_padding=False, rng=None):
+        self.data = data
+        self.batch_size = batch_size
+        self.dynamic_padding = dynamic_padding
+        self.rng = rng
+
+    def __iter__(self):
+        return iter(make_batches(self.data, self.batch_size, self.dynamic_padding, self.rng))
+
+    def __len__(self):
+        return -(-len(self.data["metrics"]) // self.batch_size)
+
+
+def make_loader(data, batches, device, pad_to=None, workers=None):
+    """
+    Prepares the batches in `workers` (by default `DEFAULT_WORKERS`) background processes, ahead of the computation.
+    The batches stay on the CPU (in pinned memory on CUDA) and are moved to the device by `to_device`.
+    """
+    workers = DEFAULT_WORKERS if workers is None else workers
+    return DataLoader(BatchDataset(data, pad_to), sampler=batches, batch_size=None, num_workers=workers,
+                      pin_memory=device.type == "cuda", persistent_workers=workers > 0)
+
+
+def to_device(inputs, device):
+    return {key: value.to(device, non_blocking=True) for key, value in inputs.items()}
@@ -1,21 +1,32 @@
 import numpy as np
 
+from data.metrics import CONFIDENCE, bootstrap_intervals
+
 
 class Metrics:
     def __init__(self, metrics):
         self.metrics = {metric: [] for metric in metrics}
+        self.matrices = []
 
-    def append(self, **kwargs):
+    def append(self, confusion_matrix=None, **kwargs):
         for metric in self.metrics:
             self.metrics[metric].append(kwargs[metric])
+        if confusion_matrix is not None:
+            self.matrices.append(confusion_matrix)
 
     def print_all_values(self):
         for name, values in self.metrics.items():
             for i, value in enumerate(values):
                 print(f"Fold:{i}, {name}: value: {value}")
 
-    def print(self):
+    def print(self, rng=None):
+        # The folds' confusion matrices add up to the one of all out-of-fold predictions
+        intervals = bootstrap_intervals(np.sum(self.matrices, axis=0), rng or np.random.default_rng()) \
+            if self.matrices else {}
         for name, values in self.metrics.items():
             print(f"Average {name}: {np.mean(values)}")
             print(f"{name} standard deviation: {np.std(values)}")
             print(f"{name} standard error: {np.std(values, ddof=1) / np.sqrt(len(values))}")
+            if name in intervals:
+                low, high = intervals[name]
+                print(f"{name} {CONFIDENCE:.0%} bootstrap interval of all folds: [{low:.4f}, {high:.4f}]")
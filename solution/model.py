@@ -1,25 +1,53 @@
+import time
+from pathlib import Path
+
 import torch
 from torch import nn, concat
 from transformers import RobertaModel
-from sklearn.metrics import classification_report, matthews_corrcoef, precision_score, accuracy_score, f1_score, recall_score
+from sklearn.metrics import classification_report
 from tqdm import tqdm
 
-from solution.data import partition_data
+from data.metrics import confusion_matrix, scores
+from solution.args import DEFAULT_EVAL_BATCH_SIZE
+from solution.data import MAX_LENGTH, make_batches
+from solution.loader import EpochBatches, make_loader, to_device
 
 LSTM_DIM = 50
+ENCODER_NAME = 'microsoft/codebert-base'
+ENCODER_HIDDEN_SIZE = 768
 
 
 class Model(nn.Module):
-    def __init__(self, metrics_dim):
+    def __init__(self, metrics_dim, pack_sequences=False, encoders=True, shared_encoder=False,
+                 gradient_checkpointing=False, encoder_config=None):
         super(Model, self).__init__()
 
-        self.codebert_comment = RobertaModel.from_pretrained(
-            'microsoft/codebert-base')
-        self.codebert_code = RobertaModel.from_pretrained(
-            'microsoft/codebert-base')
+        # By default the LSTMs read the (batch, tokens) encoder outputs as (sequence, batch) and the last token position
+        # is used, so the outputs depend on the padding length. With packed sequences, each LSTM runs over the real
+        # tokens of every sample and its final hidden state is used, which is required for dynamic padding.
+        self.pack_sequences = pack_sequences
+
+        # Without encoders, the model only accepts precomputed hidden states (see solution.embeddings).
+        # With an `encoder_config`, the encoders are randomly initialised from it instead of pretrained (for benchmarks)
+        def make_encoder():
+            return RobertaModel(encoder_config) if encoder_config is not None else \
+                RobertaModel.from_pretrained(ENCODER_NAME)
+        self.codebert_comment = make_encoder() if encoders else None
+        self.codebert_code = make_encoder() if encoders and not shared_encoder else None
+        hidden_size = encoder_config.hidden_size if encoder_config is not None else ENCODER_HIDDEN_SIZE
+        # With a shared encoder, the comments and code are encoded by `codebert_comment` in a single batch,
+        # which halves the encoder parameters and their optimizer state
+        self.shared_encoder = encoders and shared_encoder
 
-        self.lstm_comment = nn.LSTM(768, LSTM_DIM)
-        self.lstm_code = nn.LSTM(768, LSTM_DIM)
+        # Gradient checkpointing keeps only the inputs of every encoder layer for the backward pass, recomputing
+        # their activations, which trades compute for most of the activation memory
+        if gradient_checkpointing:
+            for codebert in [self.codebert_comment, self.codebert_code]:
+                if codebert is not None:
+                    codebert.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+
+        self.lstm_comment = nn.LSTM(hidden_size, LSTM_DIM)
+        self.lstm_code = nn.LSTM(hidden_size, LSTM_DIM)
 
         self.dropout_comment = nn.Dropout(0.3)
         self.dropout_code = nn.Dropout(0.3)
@@ -29,17 +57,28 @@ class Model(nn.Module):
         self.dense1 = nn.Linear(25, 5)
         self.softmax = nn.Softmax(dim=1)
 
-    def forward(self, comment_input_ids, comment_attention_masks, code_input_ids, code_attention_masks, metrics):
-        comment = self.codebert_comment(input_ids=comment_input_ids,
-                                        attention_mask=comment_attention_masks)[0]
-        code = self.codebert_code(input_ids=code_input_ids,
-                                  attention_mask=code_attention_masks)[0]
+    def forward(self, comment_attention_masks, code_attention_masks, metrics,
+                comment_input_ids=None, code_input_ids=None, comment_hidden_states=None, code_hidden_states=None):
+        comment, code = comment_hidden_states, code_hidden_states
+        if self.shared_encoder and comment is None and code is None:
+            comment, code = self._shared_encode(comment_input_ids, comment_attention_masks,
+                                                code_input_ids, code_attention_masks)
+        if comment is None:
+            comment = self.codebert_comment(input_ids=comment_input_ids,
+                                            attention_mask=comment_attention_masks)[0]
+        if code is None:
+            code = (self.codebert_comment if self.shared_encoder else self.codebert_code)(
+                input_ids=code_input_ids, attention_mask=code_attention_masks)[0]
 
-        comment, _ = self.lstm_comment(comment)
-        code, _ = self.lstm_code(code)
+        if self.pack_sequences:
+            comment = self._packed_lstm(self.lstm_comment, comment, comment_attention_masks)
+            code = self._packed_lstm(self.lstm_code, code, code_attention_masks)
+        else:
+            comment, _ = self.lstm_comment(comment)
+            code, _ = self.lstm_code(code)
 
-        comment = comment[:, -1]
-        code = code[:, -1]
+            comment = comment[:, -1]
+            code = code[:, -1]
 
         comment = self.dropout_comment(comment)
         code = self.dropout_code(code)
@@ -50,42 +89,151 @@ class Model(nn.Module):
         dense1 = self.dense1(self.relu1(dense))
         return self.softmax(dense1)
 
+    def _shared_encode(self, comment_input_ids, comment_attention_masks, code_input_ids, code_attention_masks):
+        # The shorter inputs are padded to the length of the longer ones, so that both fit in one batch.
+        # The lengths are taken as tensors and the batch is chunked, so that a traced model accepts any input sizes
+        length = torch.stack([torch._shape_as_tensor(comment_input_ids)[1],
+                              torch._shape_as_tensor(code_input_ids)[1]]).max()
+        pad_token_id = self.codebert_comment.config.pad_token_id
+
+        def pad(x, value): return nn.functional.pad(x, (0, length - x.shape[1]), value=value)
+        hidden_states = self.codebert_comment(
+            input_ids=concat((pad(comment_input_ids, pad_token_id), pad(code_input_ids, pad_token_id))),
+            attention_mask=concat((pad(comment_attention_masks, 0), pad(code_attention_masks, 0))))[0]
+        comment, code = hidden_states.chunk(2)
+        return comment[:, :comment_input_ids.shape[1]], code[:, :code_input_ids.shape[1]]
+
+    @staticmethod
+    def _packed_lstm(lstm, hidden_states, attention_masks):
+        lengths = attention_masks.sum(dim=1).clamp(min=1).cpu()
+        packed = nn.utils.rnn.pack_padded_sequence(hidden_states, lengths, batch_first=True, enforce_sorted=False)
+        _, (h_n, _) = lstm(packed)
+        return h_n[-1]
+
     # stop fine-tuning the codebert models
     # for debugging purposes
     def freeze_codeberts(self, freeze=True):
-        for param in self.codebert_comment.parameters():
-            param.requires_grad = not freeze
-        for param in self.codebert_code.parameters():
-            param.requires_grad = not freeze
+        for codebert in [self.codebert_comment, self.codebert_code]:
+            if codebert is not None:
+                for param in codebert.parameters():
+                    param.requires_grad = not freeze
+
+
+def model_size_report(model):
+    parameters = {id(p): p for p in model.parameters()}.values()
+    trainable = sum(p.numel() for p in parameters if p.requires_grad)
+    size = sum(p.numel() * p.element_size() for p in parameters)
+    # AdamW keeps two additional float32 values (the moment estimates) for every trainable parameter
+    return (f"{sum(p.numel() for p in parameters):,} parameters ({trainable:,} trainable), "
+            f"{size / 2**20:.0f} MiB of weights, {trainable * 8 / 2**20:.0f} MiB of optimizer state")
 
 
-def __to_tensor(x, device): return {key: torch.tensor(value).to(device) for key, value in x.items()}
+def _peak_memory_report(device, previous_peaks):
+    """
+    Reports the peak memory so far and its growth over the previous epoch, which is updated in `previous_peaks`.
+    The peaks are never reset, as they are process-wide (e.g. a benchmark measures the peak RSS of the training).
+    """
+    peaks = {"RSS": _peak_rss()}
+    if device.type == "cuda":
+        peaks["memory"] = torch.cuda.max_memory_allocated(device)
+    report = ""
+    for name, peak in peaks.items():
+        if peak is not None:
+            report += f", peak {name}: {peak / 2**20:.0f} MiB"
+            if (previous := previous_peaks.get(name)) is not None:
+                report += f" ({(peak - previous) / 2**20:+.0f} MiB in this epoch)"
+            previous_peaks[name] = peak
+    return report
 
 
-def train(model, device, optimizer, epochs, batch_size, X_train_set, Y_train_set, X_val_set, Y_val_set):
+def _peak_rss():
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:"))
+    except:
+        return None  # not available outside of Linux
+
+
+def predict(model, device, X_set, eval_batch_size=DEFAULT_EVAL_BATCH_SIZE, dynamic_padding=False,
+            workers=None):
+    """
+    Runs the model over the data in batches of `eval_batch_size` samples, so that the activation memory does not
+    depend on the size of the data, and returns the outputs for all samples in their original order.
+    """
+    return _predict(model, device, __eval_loader(X_set, device, eval_batch_size, dynamic_padding, workers))
+
+
+def __eval_loader(X_set, device, eval_batch_size, dynamic_padding, workers):
+    pad_to = None if dynamic_padding else MAX_LENGTH
+    return make_loader(X_set, make_batches(X_set, eval_batch_size, dynamic_padding), device, pad_to, workers)
+
+
+def _predict(model, device, loader):
+    model.eval()
+    indices, outputs = [], []
+    with torch.no_grad():
+        for idx, batch_X in loader:
+            indices.append(idx)
+            outputs.append(model(**to_device(batch_X, device)))
 
-    X_train_set, Y_train_set = __to_tensor(X_train_set, device), torch.tensor(Y_train_set).to(device)
-    X_val_set, Y_val_set = __to_tensor(X_val_set, device), torch.tensor(Y_val_set).to(device)
+    # With dynamic padding the batches are sorted by length, so the outputs are put back in order
+    return torch.cat(outputs)[torch.cat(indices).argsort().to(device)]
 
-    for epoch in range(epochs):
+
+def train(model, device, optimizer, epochs, batch_size, X_train_set, Y_train_set, X_val_set, Y_val_set,
+          dynamic_padding=False, rng=None, eval_batch_size=DEFAULT_EVAL_BATCH_SIZE, workers=None,
+          checkpoint_path=None, patience=None, bf16=False, accumulation_steps=1):
+    """
+    Trains the model for the given number of epochs. With a checkpoint path, the training state is saved after
+    every epoch and the training resumes from the saved state. With patience, the training stops once
+    the validation loss hasn't improved for that many epochs, and the weights of the best epoch are restored.
+    To save memory, the forward passes can run in bfloat16 autocast, and the gradients of several batches
+    can be accumulated into a single optimizer step (of an effective batch size of `accumulation_steps` batches).
+    """
+    pad_to = None if dynamic_padding else MAX_LENGTH
+    Y_train_set = torch.tensor(Y_train_set).to(device)
+    Y_val_set = torch.tensor(Y_val_set).to(device)
+
+    # The batches are reshuffled every epoch and prepared by the loader workers while the model computes
+    train_loader = make_loader(X_train_set, EpochBatches(X_train_set, batch_size, dynamic_padding, rng),
+                               device, pad_to, workers)
+    val_loader = __eval_loader(X_val_set, device, eval_batch_size, dynamic_padding, workers)
+
+    state = {"epoch": 0, "best_loss": float("inf"), "best_model": None, "stale_epochs": 0, "stopped": False}
+    if checkpoint_path is not None and (checkpoint := _load_checkpoint(checkpoint_path)) is not None:
+        state = _restore_checkpoint(checkpoint, model, optimizer, rng)
+        print(f"Resuming from the checkpoint of epoch {state['epoch']}/{epochs}")
+    resumed_epochs = state["epoch"]
+    peaks = {}
+
+    for epoch in range(state["epoch"], epochs if not state["stopped"] else 0):
         print(f"Epoch {epoch + 1}/{epochs}")
 
         model.train()
-        for i in tqdm(range(0, len(Y_train_set), batch_size)):
-            batch_X = partition_data(X_train_set, slice(i, i + batch_size))
-            batch_Y = Y_train_set[i:i + batch_size,]
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        steps = 0
+        for i, (idx, batch_X) in enumerate(tqdm(train_loader)):
+            batch_X = to_device(batch_X, device)
+            batch_Y = Y_train_set[idx.to(device)]
 
-            optimizer.zero_grad()
-            output = model(**batch_X)
+            with torch.autocast(device.type, dtype=torch.bfloat16, enabled=bf16):
+                output = model(**batch_X)
             loss = nn.functional.cross_entropy(
-                output, torch.argmax(batch_Y.to(torch.long), 1))
-            loss.backward()
-            optimizer.step()
+                output.float(), torch.argmax(batch_Y.to(torch.long), 1))
+            (loss / accumulation_steps).backward()
+            if (i + 1) % accumulation_steps == 0 or i + 1 == len(train_loader):
+                optimizer.step()
+                optimizer.zero_grad()
+                steps += 1
+
+        duration = time.perf_counter() - start
+        print(f"Training throughput: {len(Y_train_set) / duration:.1f} samples/s, "
+              f"step time: {duration / steps * 1000:.0f} ms{_peak_memory_report(device, peaks)}")
 
         print(f"Evaulating epoch {epoch + 1}/{epochs} on validation set")
-        model.eval()
+        output = _predict(model, device, val_loader)
         with torch.no_grad():
-            output = model(**X_val_set)
             loss = nn.functional.cross_entropy(
                 output, torch.argmax(Y_val_set.to(torch.long), 1))
 
@@ -95,18 +243,75 @@ def train(model, device, optimizer, epochs, batch_size, X_train_set, Y_train_set
                                  == torch.argmax(Y_val_set.to(torch.long), 1)).item() / len(Y_val_set)
             print(f"Validation accuracy: {accuracy}")
 
+        state["epoch"] = epoch + 1
+        if patience is not None:
+            if loss.item() < state["best_loss"]:
+                state["best_loss"], state["stale_epochs"] = loss.item(), 0
+                state["best_model"] = {key: value.detach().cpu().clone() for key, value in model.state_dict().items()}
+            else:
+                state["stale_epochs"] += 1
+            state["stopped"] = state["stale_epochs"] >= patience
+        if checkpoint_path is not None:
+            _save_checkpoint(checkpoint_path, state, model, optimizer, rng)
+        if state["stopped"]:
+            print(f"Stopping early, the validation loss hasn't improved for {patience} epochs")
+            break
 
-def evaluate(model, device, X_test_set, Y_test_set, metrics):
-    X_test_set, Y_test_set = __to_tensor(X_test_set, device), torch.tensor(Y_test_set).to(device)
+    if state["best_model"] is not None:
+        model.load_state_dict(state["best_model"])
+    saved_epochs = epochs - state["epoch"] if state["stopped"] else 0
+    print(f"Trained {state['epoch'] - resumed_epochs} epochs in this run, {state['epoch']}/{epochs} in total, "
+          f"{resumed_epochs} resumed from the checkpoint, {saved_epochs} saved by stopping early")
+    return state["epoch"]
 
-    model.eval()
-    with torch.no_grad():
-        output = model(**X_test_set)
 
+def _save_checkpoint(path, state, model, optimizer, rng):
+    checkpoint = {
+        **state,
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "rng": rng.bit_generator.state if rng is not None else None,
+        "torch_rng": torch.get_rng_state(),
+        "cuda_rng": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    torch.save(checkpoint, tmp_path)
+    tmp_path.replace(path)  # an interrupted save doesn't corrupt the previous checkpoint
+
+
+def _load_checkpoint(path):
+    try:
+        return torch.load(path, map_location="cpu", weights_only=False)
+    except FileNotFoundError:
+        return None
+
+
+def _restore_checkpoint(checkpoint, model, optimizer, rng):
+    model.load_state_dict(checkpoint.pop("model"))
+    optimizer.load_state_dict(checkpoint.pop("optimizer"))
+    if rng is not None and checkpoint["rng"] is not None:
+        rng.bit_generator.state = checkpoint["rng"]
+    torch.set_rng_state(checkpoint.pop("torch_rng"))
+    if (cuda_rng := checkpoint.pop("cuda_rng")) is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(cuda_rng)
+    checkpoint.pop("rng")
+    return checkpoint
+
+
+def evaluate(model, device, X_test_set, Y_test_set, dynamic_padding=False, eval_batch_size=DEFAULT_EVAL_BATCH_SIZE,
+             workers=None):
+    output = predict(model, device, X_test_set, eval_batch_size, dynamic_padding, workers)
+    Y_test_set = torch.tensor(Y_test_set).to(device)
+
+    with torch.no_grad():
         true_class = torch.argmax(Y_test_set.to(torch.long), 1).cpu().numpy()
         predicted_class = torch.argmax(output, 1).cpu().numpy()
         print("Test set results: ")
         print(classification_report(true_class,
               predicted_class, zero_division=0.0))
 
-    return {metric: metric_function(true_class, predicted_class) for metric, metric_function in metrics.items()}
+    # All metrics are derived from the confusion matrix, which is returned as well for pooling the folds
+    matrix = confusion_matrix(true_class, predicted_class, Y_test_set.shape[1])
+    return {**{metric: float(value) for metric, value in scores(matrix).items()}, "confusion_matrix": matrix}
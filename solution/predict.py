@@ -0,0 +1,63 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import torch
+
+from solution.args import DEFAULT_EVAL_BATCH_SIZE, positive_int
+from solution.data import get_inputs
+from solution.final_model import load_final_model
+from solution.model import predict
+from solution.student import load_student, predict_student
+
+ID_COLUMN = "meta.comment_id"
+PREDICTION_COLUMN = "prediction"
+DEFAULT_OUTPUT_PATH = "predictions.xlsx"
+
+
+def read_args():
+    parser = argparse.ArgumentParser("python -m solution.predict",
+                                     description="Classify comments with a model saved by python -m solution "
+                                                 "--final_model")
+    parser.add_argument("-m", "--model", required=True, metavar="DIR",
+                        help="Directory of the saved model")
+    parser.add_argument("-p", "--path", type=argparse.FileType(), required=True, metavar="P",
+                        help="Path to the comments, in the format of the dataset (the labels are not needed)")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT_PATH, metavar="O",
+                        help="Path of the predictions")
+    parser.add_argument("-b", "--batch_size", type=positive_int, default=DEFAULT_EVAL_BATCH_SIZE, metavar="B",
+                        help="Batch size for inference")
+    model_group = parser.add_mutually_exclusive_group()
+    model_group.add_argument("--float", action="store_true",
+                             help="Use the float model instead of the quantized TorchScript model")
+    model_group.add_argument("--student", action="store_true",
+                             help="Use the student model distilled by python -m solution.distill")
+
+    args = parser.parse_args()
+    return args.model, args.path.name, args.output, args.batch_size, args.float, args.student
+
+
+def classify(df, forest, model, config, batch_size, student=None):
+    X, _ = get_inputs(df, config["metric_columns"])
+    X["metrics"] = forest.predict_proba(X["metrics"]).astype(np.float32)
+    if student is not None:
+        probabilities = predict_student(student, X).numpy()
+    else:
+        probabilities = predict(model, torch.device("cpu"), X, batch_size, config["pack_sequences"], 0).numpy()
+
+    predictions = pd.DataFrame({f"probability.{label}": probabilities[:, i]
+                                for i, label in enumerate(config["labels"])})
+    predictions.insert(0, PREDICTION_COLUMN, np.array(config["labels"])[probabilities.argmax(axis=1)])
+    if ID_COLUMN in df:
+        predictions.insert(0, ID_COLUMN, df[ID_COLUMN].values)
+    return predictions
+
+
+if __name__ == "__main__":
+    model_path, path, output, batch_size, use_float, use_student = read_args()
+
+    forest, model, config = load_final_model(model_path, quantized=not use_float, model=not use_student)
+    student = load_student(model_path) if use_student else None
+    predictions = classify(pd.read_excel(path), forest, model, config, batch_size, student)
+    predictions.to_excel(output, index=False)
+    print(f"Saved {len(predictions)} predictions to {output}!")
@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+
+HASH_BUCKETS = 2**18
+EMBEDDING_DIM = 64
+STUDENT_FILE = "student.pt"
+
+
+class Student(nn.Module):
+    """
+    A compact classifier distilled from `Model`: the comment and the code are represented by the mean embeddings
+    of their hashed token unigrams and bigrams, which replace the encoders and LSTMs.
+    """
+
+    def __init__(self, metrics_dim, buckets=HASH_BUCKETS, embedding_dim=EMBEDDING_DIM):
+        super(Student, self).__init__()
+        self.buckets = buckets
+        self.embedding_dim = embedding_dim
+
+        self.embedding_comment = nn.EmbeddingBag(buckets, embedding_dim, mode="mean")
+        self.embedding_code = nn.EmbeddingBag(buckets, embedding_dim, mode="mean")
+
+        self.dense = nn.Linear(2 * embedding_dim + metrics_dim, 25)
+        self.relu1 = nn.ReLU()
+        self.dense1 = nn.Linear(25, 5)
+
+    def forward(self, comment_ngrams, comment_offsets, code_ngrams, code_offsets, metrics):
+        comment = self.embedding_comment(comment_ngrams, comment_offsets)
+        code = self.embedding_code(code_ngrams, code_offsets)
+        combined = torch.concat((comment, code, metrics), dim=1)
+        return self.dense1(self.relu1(self.dense(combined)))  # logits
+
+
+def save_student(student, directory):
+    checkpoint = {"model": student.state_dict(), "metrics_dim": student.dense.in_features - 2 * student.embedding_dim,
+                  "buckets": student.buckets, "embedding_dim": student.embedding_dim}
+    torch.save(checkpoint, Path(directory) / STUDENT_FILE)
+
+
+def load_student(directory):
+    checkpoint = torch.load(Path(directory) / STUDENT_FILE, map_location="cpu")
+    student = Student(checkpoint["metrics_dim"], checkpoint["buckets"], checkpoint["embedding_dim"])
+    student.load_state_dict(checkpoint["model"])
+    return student.eval()
+
+
+def to_student_inputs(data, buckets=HASH_BUCKETS):
+    inputs = {"metrics": torch.from_numpy(np.asarray(data["metrics"], dtype=np.float32))}
+    for name in ["comment", "code"]:
+        ngrams, offsets = hashed_ngrams(data[name], buckets)
+        inputs[f"{name}_ngrams"], inputs[f"{name}_offsets"] = torch.from_numpy(ngrams), torch.from_numpy(offsets)
+    return inputs
+
+
+def hashed_ngrams(tokens, buckets=HASH_BUCKETS):
+    """Hashes the token unigrams and bigrams of every sequence into `buckets` buckets, returning them as bags."""
+    values, offsets = tokens.flatten()
+    values = values.astype(np.int64)
+    sequence = np.repeat(np.arange(len(tokens)), np.diff(offsets))
+
+    # A bigram is formed by every token and its successor within the same sequence
+    is_bigram = sequence[:-1] == sequence[1:]
+    bigrams = (values[:-1][is_bigram] * 1_000_003 + values[1:][is_bigram]) % buckets
+    ngrams = np.concatenate((values % buckets, bigrams))
+    ngram_sequence = np.concatenate((sequence, sequence[:-1][is_bigram]))
+
+    order = np.argsort(ngram_sequence, kind="stable")
+    bag_offsets = np.searchsorted(ngram_sequence[order], np.arange(len(tokens)))
+    return ngrams[order], bag_offsets.astype(np.int64)
+
+
+def train_student(student, X_train, teacher_probabilities, epochs, batch_size, rng, lr=1e-3):
+    """Trains the student to match the teacher's output distribution (soft cross-entropy)."""
+    optimizer = torch.optim.Adam(student.parameters(), lr=lr)
+    teacher_probabilities = torch.as_tensor(teacher_probabilities, dtype=torch.float32)
+    size = len(teacher_probabilities)
+
+    for epoch in range(epochs):
+        student.train()
+        total_loss = 0.
+        order = rng.permutation(size)
+        for start in range(0, size, batch_size):
+            idx = order[start:start + batch_size]
+            batch = to_student_inputs({key: value[idx] for key, value in X_train.items()}, student.buckets)
+
+            optimizer.zero_grad()
+            log_probabilities = nn.functional.log_softmax(student(**batch), dim=1)
+            loss = -(teacher_probabilities[idx] * log_probabilities).sum(dim=1).mean()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(idx)
+        print(f"Student epoch {epoch + 1}/{epochs}, distillation loss: {total_loss / size:.4f}")
+
+
+def predict_student(student, X, batch_size=1024):
+    student.eval()
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, len(X["metrics"]), batch_size):
+            idx = np.arange(start, min(start + batch_size, len(X["metrics"])))
+            batch = to_student_inputs({key: value[idx] for key, value in X.items()}, student.buckets)
+            outputs.append(nn.functional.softmax(student(**batch), dim=1))
+    return torch.cat(outputs)